@@ -8,7 +8,8 @@ import os
 import collections
 from pathlib import Path
 import threading
-from typing import Dict, List, Optional
+import time
+from typing import Dict, List, Optional, Tuple
 
 from astrbot.api.star import Context, Star, register
 from astrbot.api import event
@@ -22,8 +23,14 @@ from astrbot.core.star.filter.command_group import CommandGroupFilter
 
 try:
     from . import storage
+    from .matcher import MenuMatcher, WHITESPACE_CHARS
 except ImportError:
     storage = None
+    MenuMatcher = None
+    WHITESPACE_CHARS = frozenset()
+
+# 新版本输出就绪后旧版输出再保留的秒数：此前已选中旧版输出的请求可能仍在发送
+STALE_PRUNE_DELAY = 120
 
 
 def _get_local_ip_sync():
@@ -60,27 +67,53 @@ class CustomMenuPlugin(Star):
             r"(^\s*(你|bot)?\s*(有|包含|是)\s*(什么|啥|哪些)\s*(功能|作用|能力|本事)\s*[?？]*$)|"
             r"(^\s*(你|bot)?\s*(的)?\s*(功能|作用|能力)\s*(都?有|是|包含)\s*(什么|啥|哪些)\s*[?？]*$)"
         )
+        # 正则预过滤：正常提问不会超过长度上限；正则两端锚定，消息只能由其字面字符与空白组成；
+        # 且每个分支都至少包含一个必需字符（菜单类关键词首字，或 怎/如/咋、什/啥/哪）
+        self.regex_max_len = 64
+        self.regex_alphabet = frozenset(
+            "菜单功能帮助指令列表说明书helpmenuHELPMENU这个你botBOT怎么如何咋用使操作可以都会干做写处理些有"
+            "什么啥哪呢呀包含是作力本事的?？/.") | WHITESPACE_CHARS
+        self.regex_required_chars = frozenset("菜功帮指列说hHmM怎如咋什啥哪")
+        self.match_stats = collections.Counter()
+        self._matcher = None
+        self._inflight: Dict[str, asyncio.Future] = {}
+        self._background: set = set()
+        # (菜单 id, 缓存键) -> 首次发现该版本尚未渲染的时间，用于限制旧版输出的最长发送时间
+        self._stale_since: Dict[Tuple[str, str], float] = {}
+        self.render_pool = None
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._warm_task: Optional[asyncio.Task] = None
+        self._warm_again = False
         self._init_task = asyncio.create_task(self._async_init())
 
     async def _async_init(self):
         logger.info("[CustomMenuPlugin] 开始加载资源...")
+        self._loop = asyncio.get_running_loop()
         try:
             if storage is None: raise ImportError("storage 模块加载失败")
             try:
-                import PIL, imageio, numpy
+                import PIL, imageio, imageio_ffmpeg, numpy
             except ImportError:
                 raise ImportError("缺少依赖，请安装: pip install Pillow imageio imageio-ffmpeg numpy")
             storage.plugin_storage.init_paths()
             await asyncio.to_thread(storage.plugin_storage.migrate_data)
+            from .render_pool import RenderPool
+            self.render_pool = RenderPool.from_config(self.cfg, str(storage.plugin_storage.data_dir))
             self.has_deps = True
             logger.info("✅ [CustomMenuPlugin] 初始化成功")
+            self._schedule_warm()
         except Exception as e:
             self.has_deps = False
             self.dep_error = f"{e.__class__.__name__}: {str(e)}"
             logger.error(f"❌ [CustomMenuPlugin] 加载失败: {self.dep_error}")
 
     async def on_unload(self):
+        if self.match_stats: logger.info(f"[CustomMenuPlugin] 触发匹配统计: {dict(self.match_stats)}")
+        if self.render_pool and self.render_pool.cache_stats:
+            logger.info(f"[CustomMenuPlugin] 渲染缓存统计: {dict(self.render_pool.cache_stats)}")
         if self.web_process and self.web_process.is_alive(): self.web_process.terminate()
+        if self._warm_task and not self._warm_task.done(): self._warm_task.cancel()
+        if self.render_pool: self.render_pool.shutdown()
 
     def is_admin(self, event: event.AstrMessageEvent) -> bool:
         if not self.admins_id: return True
@@ -91,7 +124,11 @@ class CustomMenuPlugin(Star):
             try:
                 if self.log_queue:
                     level, msg = self.log_queue.get(timeout=0.5)
-                    if level == "ERROR":
+                    if level == "CONFIG":
+                        # Web 进程保存了配置，使内存快照失效并在后台预渲染
+                        storage.plugin_storage.invalidate_config_snapshot()
+                        if self._loop: self._loop.call_soon_threadsafe(self._schedule_warm)
+                    elif level == "ERROR":
                         logger.error(f"[Web] {msg}")
                     elif level == "WARNING":
                         logger.warning(f"[Web] {msg}")
@@ -100,6 +137,23 @@ class CustomMenuPlugin(Star):
             except:
                 continue
 
+    async def _get_config_snapshot(self):
+        snapshot = storage.plugin_storage.get_cached_config_snapshot()
+        if snapshot is None:
+            snapshot = await asyncio.to_thread(storage.plugin_storage.get_config_snapshot)
+        return snapshot
+
+    async def _get_matcher(self) -> "MenuMatcher":
+        """获取与当前配置版本对应的触发匹配器，配置变化时重建"""
+        snapshot = await self._get_config_snapshot()
+        matcher = self._matcher
+        if matcher is None or matcher.version != snapshot.version:
+            matcher = MenuMatcher(snapshot.menus, self.regex_pattern, snapshot.version,
+                                  required_chars=self.regex_required_chars, alphabet=self.regex_alphabet,
+                                  max_len=self.regex_max_len, stats=self.match_stats)
+            self._matcher = matcher
+        return matcher
+
     def get_astrbot_commands(self) -> Dict[str, List[Dict[str, str]]]:
         plugin_commands = collections.defaultdict(list)
         try:
@@ -143,6 +197,7 @@ class CustomMenuPlugin(Star):
         return dict(plugin_commands)
 
     async def _send_smart_result(self, event_obj, path_str: str):
+        from .render_pool import IMAGE_SEND_MAX_BYTES
         try:
             path_obj = Path(path_str).resolve()
             size_bytes = os.path.getsize(path_obj)
@@ -150,9 +205,8 @@ class CustomMenuPlugin(Star):
 
             file_path_str = str(path_obj.resolve())
 
-            # 阈值 15MB
-            if size_mb > 15:
-                logger.info(f"文件体积 ({size_mb:.2f}MB) 超过15MB，转为文件发送")
+            if size_bytes > IMAGE_SEND_MAX_BYTES:
+                logger.info(f"文件体积 ({size_mb:.2f}MB) 超过{IMAGE_SEND_MAX_BYTES // (1024 * 1024)}MB，转为文件发送")
                 await event_obj.send(event_obj.chain_result([
                     File(file=file_path_str, name=path_obj.name),
                     Plain(f" ⚠️ 菜单文件较大({size_mb:.1f}MB)，已转为文件形式发送。")
@@ -178,6 +232,218 @@ class CustomMenuPlugin(Star):
             except:
                  pass
 
+    async def _single_flight(self, key: str, factory):
+        """同一缓存键同一时间只渲染一次，并发的其余请求等待同一结果"""
+        fut = self._inflight.get(key)
+        if fut is None:
+            fut = asyncio.ensure_future(factory())
+            self._inflight[key] = fut
+            fut.add_done_callback(lambda _: self._inflight.pop(key, None))
+        # shield: 单个等待者被取消时不影响其他等待同一渲染的请求
+        return await asyncio.shield(fut)
+
+    def _menu_targets(self, menu_data: dict, cache_key: str) -> List[Tuple[Path, dict, bool]]:
+        """列出菜单需要的全部输出: [(缓存路径, 渲染用菜单数据, 是否动画)]，随机背景菜单每个背景一项"""
+        is_video_mode = (menu_data.get("bg_type") == "video")
+        backgrounds_list = menu_data.get("backgrounds", [])
+
+        if len(backgrounds_list) > 1 and not is_video_mode:
+            targets = []
+            for i, bg_name in enumerate(backgrounds_list):
+                cache_path = storage.plugin_storage.get_menu_output_cache_path(menu_data, False, "png", bg_index=i,
+                                                                               cache_key=cache_key)
+                # 创建一个临时的menu_data，指定单个背景
+                temp_menu_data = menu_data.copy()
+                temp_menu_data["background"] = bg_name
+                temp_menu_data["backgrounds"] = []  # 清空列表，使用单个背景
+                targets.append((cache_path, temp_menu_data, False))
+            return targets
+
+        output_format_key = menu_data.get("video_export_format", "apng") if is_video_mode else "png"
+        cache_path = storage.plugin_storage.get_menu_output_cache_path(menu_data, is_video_mode, output_format_key,
+                                                                       cache_key=cache_key)
+        return [(cache_path, menu_data, is_video_mode)]
+
+    async def _render_target(self, cache_path: Path, menu_data: dict, is_video: bool) -> Optional[Path]:
+        """渲染单个输出到缓存（同一缓存键并发只渲染一次），返回输出路径，动画渲染失败返回 None"""
+        from .render_pool import IMAGE_SEND_MAX_BYTES, render_static_job, render_animated_job
+
+        async def job():
+            if cache_path.exists(): return cache_path
+            if is_video:
+                result = await self.render_pool.submit(render_animated_job, menu_data, str(cache_path),
+                                                        IMAGE_SEND_MAX_BYTES)
+                return Path(result) if result else None
+            await self.render_pool.submit(render_static_job, menu_data, str(cache_path))
+            return cache_path
+
+        return await self._single_flight(str(cache_path), job)
+
+    def _spawn(self, coro) -> "asyncio.Future":
+        """后台任务：保留引用直到完成，避免未被等待的任务被回收"""
+        task = asyncio.ensure_future(coro)
+        self._background.add(task)
+        task.add_done_callback(self._background.discard)
+        return task
+
+    def _stale_outputs(self, menu_data: dict, cache_key: str) -> List[Path]:
+        """
+        新版本尚未渲染完成时可先发送的上一版输出：严格模式 (cache_strict) 的菜单、
+        或距首次发现新版本已超过 stale_max_seconds 时返回空列表
+        """
+        max_age = float(self.cfg.get("stale_max_seconds", 600) or 0)
+        if max_age <= 0 or menu_data.get("cache_strict"): return []
+        since = self._stale_since.setdefault((menu_data.get("id"), cache_key), time.time())
+        if time.time() - since > max_age: return []
+        return storage.plugin_storage.find_stale_outputs(menu_data.get("id"), cache_key)
+
+    async def _drop_stale(self, menu_data: dict, cache_key: str, targets: list):
+        """菜单的全部输出就绪后，等待 STALE_PRUNE_DELAY 秒再删除此前生成的旧版输出（在后台任务中运行）"""
+        if not all(t[0].exists() for t in targets): return
+        self._stale_since.pop((menu_data.get("id"), cache_key), None)
+        ready_at = time.time()
+        await asyncio.sleep(STALE_PRUNE_DELAY)
+        await asyncio.to_thread(storage.plugin_storage.prune_stale_outputs, menu_data.get("id"), cache_key, ready_at)
+
+    async def _revalidate(self, menu_data: dict, cache_key: str, targets: list, tasks: Optional[dict] = None):
+        """后台渲染菜单缺失的输出（tasks 为已提交的渲染任务），全部完成后删除旧版输出"""
+        try:
+            if tasks is None:
+                missing = [t for t in targets if not t[0].exists()]
+                if len(targets) > 1:
+                    tasks = self._render_variants(menu_data, cache_key, missing, None)
+                elif missing:
+                    tasks = {missing[0][0]: self._render_target(*missing[0])}
+            await asyncio.gather(*(tasks or {}).values())
+            self._spawn(self._drop_stale(menu_data, cache_key, targets))
+        except Exception as e:
+            logger.warning(f"后台重新渲染失败: {menu_data.get('name')}: {e}")
+
+    async def _render_poster(self, menu_data: dict, cache_key: str) -> Optional[Path]:
+        """渲染动态菜单的静态封面（视频首帧作背景），失败返回 None"""
+        from .render_pool import render_poster_job
+        poster_path = storage.plugin_storage.get_menu_output_cache_path(menu_data, True, cache_key=cache_key,
+                                                                        poster=True)
+
+        async def job():
+            if poster_path.exists(): return poster_path
+            result = await self.render_pool.submit(render_poster_job, menu_data, str(poster_path))
+            return Path(result) if result else None
+
+        return await self._single_flight(str(poster_path), job)
+
+    async def _send_animation_later(self, event_obj, menu_data: dict, cache_key: str, targets: list):
+        """已先发送封面时等待动画渲染完成后再发送"""
+        cache_path, render_data, _ = targets[0]
+        try:
+            result_path = await self._render_target(cache_path, render_data, True)
+        except Exception as e:
+            logger.warning(f"动态菜单后台渲染失败: {menu_data.get('name')}: {e}")
+            return
+        if result_path and result_path.exists():
+            self._spawn(self._drop_stale(menu_data, cache_key, targets))
+            await self._send_smart_result(event_obj, str(result_path))
+        else:
+            await event_obj.send(event_obj.plain_result(f"❌ 动态菜单 {menu_data.get('name')} 渲染失败，请检查视频源。"))
+
+    def _render_variants(self, menu_data: dict, cache_key: str, targets: list,
+                         first: Optional[Path]) -> Dict[Path, "asyncio.Future"]:
+        """
+        随机背景各版本并发渲染：前景只在一个工作进程中绘制一次，各版本只合成各自的背景层，
+        first 对应的版本最先提交；其余版本同时最多提交 max_workers 个，背景很多的菜单不会独占渲染队列；
+        返回 {缓存路径: 渲染任务}，未被等待的任务在后台继续完成
+        """
+        from .render_pool import render_foreground_job, render_variant_job
+
+        fg_key = f"fg:{menu_data.get('id')}:{cache_key}"
+        foreground = []
+        rest_slots = asyncio.Semaphore(self.render_pool.max_workers)
+
+        def shared_foreground():
+            # 首个需要渲染的版本才提交前景任务，其余版本等待同一结果
+            if not foreground:
+                foreground.append(asyncio.ensure_future(
+                    self._single_flight(fg_key, lambda: self.render_pool.submit(render_foreground_job, menu_data))))
+            return foreground[0]
+
+        def variant(cache_path: Path, render_data: dict):
+            async def submit(overlay, blur_regions, sizes):
+                await self.render_pool.submit(render_variant_job, render_data, (overlay, blur_regions),
+                                              sizes.get(render_data.get("background")), str(cache_path))
+
+            async def job():
+                if cache_path.exists(): return cache_path
+                fg = await shared_foreground()
+                if cache_path == first:
+                    await submit(*fg)
+                else:
+                    async with rest_slots:
+                        if cache_path.exists(): return cache_path
+                        await submit(*fg)
+                return cache_path
+
+            return self._single_flight(str(cache_path), job)
+
+        def log_result(task: "asyncio.Future"):
+            if task.cancelled(): return
+            if (e := task.exception()) is not None:
+                logger.warning(f"随机背景版本渲染失败: {menu_data.get('name')}: {e}")
+            else:
+                logger.info(f"  ✅ 已缓存背景版本: {task.result().name}")
+
+        tasks = {}
+        for cache_path, render_data, _ in sorted(targets, key=lambda t: t[0] != first):
+            tasks[cache_path] = self._spawn(variant(cache_path, render_data))
+            tasks[cache_path].add_done_callback(log_result)
+        return tasks
+
+    def _schedule_warm(self):
+        """安排一次后台预渲染；已在运行时合并为运行结束后再执行一轮"""
+        if not self.has_deps or not self.cfg.get("prewarm_enabled", True): return
+        if self._warm_task and not self._warm_task.done():
+            self._warm_again = True
+            return
+        self._warm_task = asyncio.create_task(self._warm_loop())
+
+    async def _warm_loop(self):
+        while True:
+            self._warm_again = False
+            try:
+                await self._warm_menus()
+            except Exception:
+                logger.error(f"[预渲染] 异常: {traceback.format_exc()}")
+            if not self._warm_again: break
+
+    async def _warm_menus(self):
+        """低优先级预渲染所有启用菜单的全部输出：逐个提交，且仅在渲染池空闲时提交"""
+        snapshot = await self._get_config_snapshot()
+        pending = []
+        for menu_data in snapshot.menus:
+            if not menu_data.get("enabled", True): continue
+            cache_key = await asyncio.to_thread(storage.plugin_storage.compute_menu_cache_key, menu_data)
+            targets = self._menu_targets(menu_data, cache_key)
+            for target in targets:
+                if not target[0].exists(): pending.append((menu_data, cache_key, targets, target))
+            # 配置变化后从这里开始计算旧版输出的陈旧时间
+            if any(not t[0].exists() for t in targets):
+                self._stale_since.setdefault((menu_data.get("id"), cache_key), time.time())
+        if not pending: return
+
+        logger.info(f"[预渲染] 开始: {len(pending)} 个菜单输出待渲染")
+        for i, (menu_data, cache_key, targets, (cache_path, render_data, is_video)) in enumerate(pending, 1):
+            name = menu_data.get("name")
+            # 配置再次变化时放弃本轮，由下一轮按新配置渲染
+            if self._warm_again: return
+            while self.render_pool.pending > 0:
+                await asyncio.sleep(0.5)
+            try:
+                result = await self._render_target(cache_path, render_data, is_video)
+                logger.info(f"[预渲染] {i}/{len(pending)} {'✅' if result else '❌'} {name} ({cache_path.name})")
+                if result: self._spawn(self._drop_stale(menu_data, cache_key, targets))
+            except Exception as e:
+                logger.warning(f"[预渲染] {i}/{len(pending)} ❌ {name}: {e}")
+        logger.info("[预渲染] 完成")
+
     async def _generate_menu_chain(self, event_obj, specific_menus=None):
         if self._init_task and not self._init_task.done():
             try:
@@ -190,100 +456,103 @@ class CustomMenuPlugin(Star):
             return
 
         try:
-            from .renderer.menu import render_static, render_animated
-            
+            from .render_pool import RenderQueueFull
+
             # 如果没有传入指定的菜单列表，则加载全部并筛选通用菜单
             target_menus = []
             if specific_menus:
                 target_menus = specific_menus
             else:
                 # 加载所有启用的、且没有设置特定触发词的菜单（作为默认菜单）
-                root_config = await asyncio.to_thread(storage.plugin_storage.load_config)
-                menus = root_config.get("menus", [])
-                target_menus = [
-                    m for m in menus
-                    if m.get("enabled", True) and not m.get("trigger_keywords", "").strip()
-                ]
+                target_menus = (await self._get_matcher()).default_menus
 
             if not target_menus:
                 # 没有默认菜单时静默返回，不发送提示
                 return
 
             for menu_data in target_menus:
-                menu_id = menu_data.get("id")
                 is_video_mode = (menu_data.get("bg_type") == "video")
-                
-                # 检查是否使用随机背景（有多张背景图配置时）
-                backgrounds_list = menu_data.get("backgrounds", [])
-                has_random_bg = len(backgrounds_list) > 1
-
-                output_format_key = "png"
-                if is_video_mode:
-                    output_format_key = menu_data.get("video_export_format", "apng")
 
                 try:
-                    if has_random_bg and not is_video_mode:
+                    # 缓存键由菜单内容与素材指纹决定，未修改的菜单在保存/上传后仍可命中缓存
+                    cache_key = await asyncio.to_thread(storage.plugin_storage.compute_menu_cache_key, menu_data)
+                    targets = self._menu_targets(menu_data, cache_key)
+
+                    if len(targets) > 1:
                         # 随机背景模式：预渲染所有背景版本，随机选择一个输出
                         import random
-                        
-                        # 检查所有背景版本是否都已缓存
-                        all_cached = True
-                        cache_paths = []
-                        for i, bg_name in enumerate(backgrounds_list):
-                            cache_path = storage.plugin_storage.get_menu_output_cache_path(menu_id, False, "png", bg_index=i)
-                            cache_paths.append(cache_path)
-                            if not cache_path.exists():
-                                all_cached = False
-                        
-                        if all_cached:
-                            # 所有版本都已缓存，随机选择一个
-                            chosen_path = random.choice(cache_paths)
+
+                        cache_paths = [t[0] for t in targets]
+                        chosen_path = random.choice(cache_paths)
+                        missing = [t for t in targets if not t[0].exists()]
+                        if not missing:
+                            # 所有版本都已缓存
                             logger.info(f"✅ 从随机背景缓存发送: {menu_data.get('name')} ({chosen_path.name})")
                             await self._send_smart_result(event_obj, str(chosen_path))
                             continue
-                        
-                        # 需要渲染缺失的版本
-                        logger.info(f"渲染菜单随机背景版本: {menu_data.get('name')} (共{len(backgrounds_list)}个背景)")
-                        for i, bg_name in enumerate(backgrounds_list):
-                            cache_path = cache_paths[i]
-                            if cache_path.exists():
-                                continue
-                            # 创建一个临时的menu_data，指定单个背景
-                            temp_menu_data = menu_data.copy()
-                            temp_menu_data["background"] = bg_name
-                            temp_menu_data["backgrounds"] = []  # 清空列表，使用单个背景
-                            img = await asyncio.to_thread(render_static, temp_menu_data)
-                            await asyncio.to_thread(img.save, cache_path)
-                            logger.info(f"  ✅ 已缓存背景 {i+1}/{len(backgrounds_list)}: {bg_name}")
-                        
-                        # 随机选择一个输出
-                        chosen_path = random.choice(cache_paths)
+
+                        if not chosen_path.exists() and (stale := await asyncio.to_thread(
+                                self._stale_outputs, menu_data, cache_key)):
+                            # 先发送上一版输出，新版本在后台渲染
+                            logger.info(f"⏳ 先发送旧版随机背景缓存并后台重新渲染: {menu_data.get('name')}")
+                            self._spawn(self._revalidate(menu_data, cache_key, targets))
+                            await self._send_smart_result(event_obj, str(random.choice(stale)))
+                            continue
+
+                        # 缺失的版本并发渲染，选中的版本就绪即发送，其余版本在后台继续渲染
+                        logger.info(f"渲染菜单随机背景版本: {menu_data.get('name')} "
+                                    f"(缺失{len(missing)}/{len(targets)}个背景)")
+                        tasks = self._render_variants(menu_data, cache_key, missing, chosen_path)
+                        self._spawn(self._revalidate(menu_data, cache_key, targets, tasks))
+                        if chosen_path in tasks: await tasks[chosen_path]
                         logger.info(f"✅ 随机选择发送: {chosen_path.name}")
                         await self._send_smart_result(event_obj, str(chosen_path))
                         continue
-                    
+
                     # 非随机背景模式
-                    cache_path = storage.plugin_storage.get_menu_output_cache_path(menu_id, is_video_mode,
-                                                                                   output_format_key)
+                    cache_path, render_data, _ = targets[0]
 
                     if cache_path.exists():
                         logger.info(f"✅ 从缓存发送: {menu_data.get('name')}")
                         await self._send_smart_result(event_obj, str(cache_path))
                         continue
 
-                    logger.info(f"渲染菜单: {menu_data.get('name')} (模式: {'动画' if is_video_mode else '静态'})")
+                    if stale := await asyncio.to_thread(self._stale_outputs, menu_data, cache_key):
+                        # 先发送上一版输出，新版本在后台渲染
+                        logger.info(f"⏳ 先发送旧版缓存并后台重新渲染: {menu_data.get('name')}")
+                        self._spawn(self._revalidate(menu_data, cache_key, targets))
+                        await self._send_smart_result(event_obj, str(stale[0]))
+                        continue
 
-                    if is_video_mode:
-                        result_path = await asyncio.to_thread(render_animated, menu_data, cache_path)
-                        if result_path and result_path.exists():
-                            await self._send_smart_result(event_obj, str(result_path))
+                    poster_mode = self.cfg.get("video_poster_mode", "off")
+                    if is_video_mode and poster_mode != "off" and (
+                            poster_path := await self._render_poster(menu_data, cache_key)):
+                        # 先发送视频首帧作背景的静态封面，动画在后台渲染
+                        logger.info(f"🖼️ 先发送动态菜单封面: {menu_data.get('name')}")
+                        await self._send_smart_result(event_obj, str(poster_path))
+                        if poster_mode == "send":
+                            self._spawn(self._send_animation_later(event_obj, menu_data, cache_key, targets))
                         else:
-                            await event_obj.send(event_obj.plain_result(f"❌ 动态菜单 {menu_data.get('name')} 渲染失败，请检查视频源。"))
+                            self._spawn(self._revalidate(menu_data, cache_key, targets))
+                        continue
+
+                    logger.info(f"渲染菜单: {menu_data.get('name')} (模式: {'动画' if is_video_mode else '静态'})")
+
+                    result_path = await self._render_target(cache_path, render_data, is_video_mode)
+                    if result_path and result_path.exists():
+                        self._spawn(self._drop_stale(menu_data, cache_key, targets))
+                        await self._send_smart_result(event_obj, str(result_path))
                     else:
-                        img = await asyncio.to_thread(render_static, menu_data)
-                        await asyncio.to_thread(img.save, cache_path)
-                        await self._send_smart_result(event_obj, str(cache_path))
+                        await event_obj.send(event_obj.plain_result(f"❌ 动态菜单 {menu_data.get('name')} 渲染失败，请检查视频源。"))
 
+                except RenderQueueFull:
+                    logger.warning(f"渲染队列已满，跳过菜单: {menu_data.get('name')}")
+                    await event_obj.send(event_obj.plain_result("⚠️ 菜单渲染繁忙，请稍后再试"))
+                    continue
+                except asyncio.TimeoutError:
+                    logger.error(f"渲染超时: {menu_data.get('name')}")
+                    await event_obj.send(event_obj.plain_result(f"❌ 菜单 {menu_data.get('name')} 渲染超时"))
+                    continue
                 except Exception as e:
                     logger.error(f"渲染失败: {traceback.format_exc()}")
                     await event_obj.send(event_obj.plain_result(f"❌ 渲染错误: {e}"))
@@ -297,24 +566,15 @@ class CustomMenuPlugin(Star):
         msg = event.message_str.strip()
         if not msg: return
 
-        # 1. 加载所有菜单配置
+        # 1. 获取当前配置版本的触发索引
         try:
-            root_config = await asyncio.to_thread(storage.plugin_storage.load_config)
-            all_menus = root_config.get("menus", [])
-            enabled_menus = [m for m in all_menus if m.get("enabled", True)]
+            matcher = await self._get_matcher()
         except Exception as e:
             logger.error(f"读取配置失败: {e}")
             return
 
         # 2. 优先检测：特定触发词菜单
-        matched_specific_menus = []
-        for m in enabled_menus:
-            triggers_str = m.get("trigger_keywords", "")
-            if triggers_str:
-                # 支持逗号、分号、空格分隔
-                triggers = [t.strip() for t in re.split(r'[,，;；\s]+', triggers_str) if t.strip()]
-                if msg in triggers:
-                    matched_specific_menus.append(m)
+        matched_specific_menus = matcher.match_keyword(msg)
 
         # 3. 如果匹配到特定菜单，则只发送这些菜单，不检测全局正则
         if matched_specific_menus:
@@ -323,9 +583,9 @@ class CustomMenuPlugin(Star):
             return
 
         # 4. 如果没有匹配到特定菜单，则检测全局 Regex
-        if self.regex_pattern.search(msg):
+        if matcher.match_default(msg):
             if hasattr(event, "stop_event_propagation"): event.stop_event_propagation()
-            # 传入 None 让 _generate_menu_chain 内部去筛选默认菜单 (即 trigger_keywords 为空的)
+            # 传入 None 让 _generate_menu_chain 内部去取默认菜单 (即 trigger_keywords 为空的)
             await self._generate_menu_chain(event, specific_menus=None)
 
     @filter.command("开启后台")
@@ -0,0 +1,71 @@
+import re
+import collections
+from typing import Dict, Any, List, Optional, Pattern, FrozenSet
+
+# 支持逗号、分号、空格分隔
+_TRIGGER_SPLIT_RE = re.compile(r'[,，;；\s]+')
+# 正则 \s 可匹配的全部空白字符（Unicode 空白字符均位于 U+3000 及以下）
+WHITESPACE_CHARS = frozenset(c for c in map(chr, range(0x3001)) if c.isspace())
+
+
+def split_trigger_keywords(triggers_str: str) -> List[str]:
+    return [t.strip() for t in _TRIGGER_SPLIT_RE.split(triggers_str or "") if t.strip()]
+
+
+class MenuMatcher:
+    """
+    按配置版本构建一次的触发索引
+    - 特定触发词: 关键词 -> 菜单列表 的字典，O(1) 查表，与菜单/关键词数量无关
+    - 全局正则: 未命中特定触发词时的回退，命中后发送默认菜单（未设置触发词的菜单）
+    - 预过滤: 正则之前依次检查长度上限、字符表（两端锚定的正则只能匹配由其字面字符组成的消息）
+      和必需字符（每个分支至少包含其一），绝大多数聊天消息在此被拒绝
+    stats 记录各阶段命中/拒绝的消息数，可在多个版本的匹配器之间共享
+    """
+
+    def __init__(self, menus: List[Dict[str, Any]], regex_pattern: Optional[Pattern], version: int = 0,
+                 required_chars: Optional[FrozenSet[str]] = None, alphabet: Optional[FrozenSet[str]] = None,
+                 max_len: int = 0, stats: Optional[collections.Counter] = None):
+        self.version = version
+        self.regex_pattern = regex_pattern
+        self.required_chars = required_chars
+        self.alphabet = alphabet
+        self.max_len = max_len
+        self.stats = stats if stats is not None else collections.Counter()
+        self.keyword_index: Dict[str, List[Dict[str, Any]]] = {}
+        self.default_menus: List[Dict[str, Any]] = []
+
+        for m in menus:
+            if not m.get("enabled", True): continue
+            triggers_str = m.get("trigger_keywords", "")
+            if not triggers_str.strip():
+                self.default_menus.append(m)
+                continue
+            for keyword in split_trigger_keywords(triggers_str):
+                bucket = self.keyword_index.setdefault(keyword, [])
+                # 同一菜单重复填写同一触发词时只发送一次
+                if not bucket or bucket[-1] is not m:
+                    bucket.append(m)
+
+    def match_keyword(self, msg: str) -> List[Dict[str, Any]]:
+        """返回触发词精确匹配的菜单（按配置顺序），未命中返回空列表"""
+        menus = self.keyword_index.get(msg, [])
+        if menus: self.stats["keyword_matched"] += 1
+        return menus
+
+    def match_default(self, msg: str) -> bool:
+        """是否命中全局帮助正则（先经过长度与字符集预过滤）"""
+        if not self.regex_pattern: return False
+        if self.max_len and len(msg) > self.max_len:
+            self.stats["length_rejected"] += 1
+            return False
+        if self.alphabet is not None and not self.alphabet.issuperset(msg):
+            self.stats["alphabet_rejected"] += 1
+            return False
+        if self.required_chars is not None and self.required_chars.isdisjoint(msg):
+            self.stats["required_char_rejected"] += 1
+            return False
+        if self.regex_pattern.search(msg):
+            self.stats["regex_matched"] += 1
+            return True
+        self.stats["regex_rejected"] += 1
+        return False
@@ -0,0 +1,225 @@
+import asyncio
+import collections
+import multiprocessing
+import weakref
+import concurrent.futures
+from concurrent.futures.process import BrokenProcessPool
+from pathlib import Path
+from typing import Dict, Any, Optional
+
+try:
+    from astrbot.api import logger
+except ImportError:
+    import logging
+
+    logger = logging.getLogger(__name__)
+
+from .storage import plugin_storage
+from .renderer import cache as render_cache
+
+
+# 超过该体积的图片不再以图片消息发送（转为文件），动态菜单据此限制输出体积
+IMAGE_SEND_MAX_BYTES = 15 * 1024 * 1024
+
+
+class RenderQueueFull(RuntimeError):
+    """渲染队列已满，调用方应提示稍后重试"""
+
+
+class _ThreadStillRunning(Exception):
+    """线程模式下超时/取消的任务仍在后台运行，future 结束前不能释放名额"""
+
+    def __init__(self, future, error):
+        super().__init__(str(error))
+        self.future = future
+        self.error = error
+
+
+# ==========================================================
+#  渲染任务（在工作进程中执行，必须是模块级函数以便序列化）
+# ==========================================================
+def _init_worker(data_dir: str, cache_cfg: Dict[str, Any]):
+    if data_dir: plugin_storage.init_paths(data_dir)
+    render_cache.configure(cache_cfg)
+
+
+def _run_job(fn, *args):
+    """在工作进程/线程中执行任务，连同期间的渲染缓存命中计数一并返回"""
+    return fn(*args), render_cache.take_counters()
+
+
+def render_static_job(menu_data: Dict[str, Any], output_path: str) -> str:
+    from .renderer.menu import render_static
+    img = render_static(menu_data)
+    with plugin_storage.atomic_output(Path(output_path)) as tmp_path:
+        img.save(tmp_path)
+    return output_path
+
+
+def render_foreground_job(menu_data: Dict[str, Any]):
+    from .renderer.menu import render_shared_foreground
+    return render_shared_foreground(menu_data)
+
+
+def render_variant_job(menu_data: Dict[str, Any], foreground, size, output_path: str) -> str:
+    """用共享前景合成随机背景的单个版本，menu_data 中 background 为该版本的背景"""
+    from .renderer.menu import render_static
+    img = render_static(menu_data, foreground, size)
+    with plugin_storage.atomic_output(Path(output_path)) as tmp_path:
+        img.save(tmp_path)
+    return output_path
+
+
+def render_poster_job(menu_data: Dict[str, Any], output_path: str) -> Optional[str]:
+    from .renderer.menu import render_poster
+    img = render_poster(menu_data)
+    if img is None: return None
+    with plugin_storage.atomic_output(Path(output_path)) as tmp_path:
+        img.save(tmp_path)
+    return output_path
+
+
+def build_video_proxy_job(video_name: str) -> Optional[str]:
+    """为上传的视频生成低分辨率代理，返回代理路径；不需要代理时返回 None"""
+    from .renderer.video import build_video_proxy
+    proxy_path, meta_path = plugin_storage.get_video_proxy_paths(video_name)
+    info = build_video_proxy(plugin_storage.video_dir / video_name, proxy_path, meta_path)
+    return str(proxy_path) if info else None
+
+
+def render_animated_job(menu_data: Dict[str, Any], output_path: str,
+                        byte_budget: Optional[int] = None) -> Optional[str]:
+    from .renderer.menu import render_animated
+    result = render_animated(menu_data, Path(output_path), byte_budget)
+    return str(result) if result else None
+
+
+class RenderPool:
+    """
+    有界渲染池
+    - 进程模式: 渲染在独立进程中执行，不占用 Bot 事件循环所在进程的 GIL
+    - 线程模式: 守护进程（如 Web 后台）中不能再创建子进程，或 workers 为 0 时使用
+    超过 queue_limit 个未完成任务时拒绝新任务；同时只向执行器提交 max_workers 个任务，其余在此排队，
+    timeout 只统计任务实际执行的时间，超时则取消：
+    - 进程模式下正在运行的超时任务只能通过重建进程池终止，同一进程池中被一并终止的其他任务在新进程池中重试一次
+    - 线程模式下超时的线程无法终止，会在后台运行到结束，结束前仍占用队列名额
+    """
+
+    def __init__(self, max_workers: int = 2, queue_limit: int = 8, timeout: float = 180,
+                 data_dir: Optional[str] = None, use_processes: bool = True,
+                 cache_cfg: Optional[Dict[str, Any]] = None):
+        self.max_workers = max(1, int(max_workers))
+        self.queue_limit = max(1, int(queue_limit))
+        self.timeout = float(timeout) if timeout and float(timeout) > 0 else None
+        self.data_dir = data_dir
+        self.cache_cfg = cache_cfg or {}
+        # 守护进程不允许拥有子进程
+        self.use_processes = use_processes and not multiprocessing.current_process().daemon
+        self._executor: Optional[concurrent.futures.Executor] = None
+        # 因任务超时而被主动终止的进程池，其中被一并终止的任务需要重试
+        self._recycled = weakref.WeakSet()
+        self._pending = 0
+        # 执行名额：进程池一接收任务就视为运行中，排队中的任务无法取消，因此排队留在这里而不是执行器内部
+        self._slots = asyncio.Semaphore(self.max_workers)
+        # 各工作进程交回的渲染缓存命中/未命中/淘汰次数累计
+        self.cache_stats = collections.Counter()
+
+    @classmethod
+    def from_config(cls, cfg: Dict[str, Any], data_dir: Optional[str] = None) -> "RenderPool":
+        workers = int(cfg.get("render_workers", 2))
+        cache_cfg = {k: cfg[k] for k in ("font_cache_mb", "asset_cache_mb", "layout_cache_mb", "tile_cache_mb",
+                                         "background_cache_mb") if k in cfg}
+        return cls(max_workers=workers or 1, queue_limit=int(cfg.get("render_queue_limit", 8)),
+                   timeout=float(cfg.get("render_timeout", 180)), data_dir=data_dir, use_processes=workers > 0,
+                   cache_cfg=cache_cfg)
+
+    @property
+    def pending(self) -> int:
+        return self._pending
+
+    def _ensure_executor(self) -> concurrent.futures.Executor:
+        if self._executor is None:
+            if self.use_processes:
+                self._executor = concurrent.futures.ProcessPoolExecutor(
+                    max_workers=self.max_workers, mp_context=multiprocessing.get_context('spawn'),
+                    initializer=_init_worker, initargs=(self.data_dir, self.cache_cfg))
+            else:
+                # 线程模式下缓存位于当前进程
+                render_cache.configure(self.cache_cfg)
+                self._executor = concurrent.futures.ThreadPoolExecutor(
+                    max_workers=self.max_workers, thread_name_prefix="menu_render")
+        return self._executor
+
+    def _recycle(self):
+        """终止所有工作进程并丢弃进程池，下次提交时重建"""
+        executor, self._executor = self._executor, None
+        if executor is None: return
+        self._recycled.add(executor)
+        processes = list((getattr(executor, "_processes", None) or {}).values())
+        executor.shutdown(wait=False, cancel_futures=True)
+        for p in processes:
+            try:
+                p.terminate()
+            except Exception:
+                pass
+
+    async def submit(self, fn, *args):
+        if self._pending >= self.queue_limit:
+            raise RenderQueueFull(f"渲染队列已满 ({self._pending}/{self.queue_limit})")
+        self._pending += 1
+        release = True
+        try:
+            await self._slots.acquire()
+            try:
+                return await self._run(fn, args)
+            except _ThreadStillRunning as e:
+                # 线程仍在运行，结束后才释放执行名额与队列名额
+                release = False
+                loop = asyncio.get_running_loop()
+                e.future.add_done_callback(lambda _: loop.call_soon_threadsafe(self._release, True))
+                raise e.error
+            finally:
+                if release: self._slots.release()
+        finally:
+            if release: self._release()
+
+    async def _run(self, fn, args):
+        """在已取得执行名额时提交任务并计时"""
+        for attempt in range(2):
+            executor = self._ensure_executor()
+            cf = executor.submit(_run_job, fn, *args)
+            try:
+                result, counters = await asyncio.wait_for(asyncio.wrap_future(cf), timeout=self.timeout)
+                self.cache_stats.update(counters)
+                return result
+            except (asyncio.TimeoutError, asyncio.CancelledError) as e:
+                if cf.cancelled() and executor in self._recycled and attempt == 0:
+                    # 尚未开始的任务随其他任务超时重建进程池被取消，在新进程池中重试
+                    continue
+                if not cf.cancel() and not cf.done():
+                    if self.use_processes:
+                        logger.warning(f"渲染任务 {getattr(fn, '__name__', fn)} 超时/取消，重建渲染进程池")
+                        if self._executor is executor: self._recycle()
+                    else:
+                        logger.warning(f"渲染任务 {getattr(fn, '__name__', fn)} 超时/取消，线程将在后台结束")
+                        raise _ThreadStillRunning(cf, e)
+                raise
+            except BrokenProcessPool:
+                if executor in self._recycled and attempt == 0:
+                    # 正在运行的任务随其他任务超时重建进程池被终止，在新进程池中重试
+                    logger.info(f"渲染任务 {getattr(fn, '__name__', fn)} 所在进程池已重建，重新提交")
+                    continue
+                # 只丢弃本任务所在的进程池，不影响之后已重建的进程池
+                if self._executor is executor: self._executor = None
+                raise
+
+    def _release(self, slot: bool = False):
+        self._pending -= 1
+        if slot: self._slots.release()
+
+    def shutdown(self):
+        if self.use_processes:
+            self._recycle()
+        elif self._executor is not None:
+            self._executor.shutdown(wait=False, cancel_futures=True)
+            self._executor = None
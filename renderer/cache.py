@@ -0,0 +1,97 @@
+import threading
+import collections
+from typing import Any, Dict, Hashable, Optional
+
+MB = 1024 * 1024
+
+
+class LRUCache:
+    """线程安全的 LRU 缓存，按调用方估算的字节数限制容量，并统计命中/未命中/淘汰次数"""
+
+    def __init__(self, name: str, max_bytes: int):
+        self.name = name
+        self.max_bytes = max_bytes
+        self._data: "collections.OrderedDict[Hashable, tuple]" = collections.OrderedDict()
+        self._bytes = 0
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, key: Hashable) -> Optional[Any]:
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+            self._data.move_to_end(key)
+            self.hits += 1
+            return entry[0]
+
+    def put(self, key: Hashable, value: Any, size: int):
+        size = max(0, int(size))
+        with self._lock:
+            old = self._data.pop(key, None)
+            if old is not None: self._bytes -= old[1]
+            # 单个条目超过容量时不缓存
+            if size > self.max_bytes: return
+            self._data[key] = (value, size)
+            self._bytes += size
+            self._evict()
+
+    def _evict(self):
+        while self._bytes > self.max_bytes and self._data:
+            _, (_, size) = self._data.popitem(last=False)
+            self._bytes -= size
+            self.evictions += 1
+
+    def resize(self, max_bytes: int):
+        with self._lock:
+            self.max_bytes = max(0, int(max_bytes))
+            self._evict()
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+            self._bytes = 0
+
+    def take_counters(self) -> Dict[str, int]:
+        """取出上次调用以来的命中/未命中/淘汰次数并清零"""
+        with self._lock:
+            counters = {f"{self.name}_hits": self.hits, f"{self.name}_misses": self.misses,
+                        f"{self.name}_evictions": self.evictions}
+            self.hits = self.misses = self.evictions = 0
+            return counters
+
+
+# 进程级缓存：渲染进程/线程共享
+font_cache = LRUCache("font", 256 * MB)
+# 解码并缩放后的 RGBA 图片（图标、组件图片、背景）以及图片尺寸
+image_cache = LRUCache("image", 256 * MB)
+# 排版树（分组/功能项矩形、换行后的文字、字体引用），按排版相关字段缓存，按序列化后的大小估算
+layout_cache = LRUCache("layout", 32 * MB)
+# 分组图块（分组背景、标题与功能项绘制结果），编辑单个分组时其余分组直接复用
+tile_cache = LRUCache("tile", 128 * MB)
+# 底色 + 背景图层以及其上各磨砂区域的模糊结果
+background_cache = LRUCache("background", 128 * MB)
+
+
+def configure(cfg: Optional[Dict[str, Any]] = None):
+    """按插件配置调整缓存容量（单位 MB）"""
+    cfg = cfg or {}
+    if "font_cache_mb" in cfg: font_cache.resize(int(cfg["font_cache_mb"]) * MB)
+    if "asset_cache_mb" in cfg: image_cache.resize(int(cfg["asset_cache_mb"]) * MB)
+    if "layout_cache_mb" in cfg: layout_cache.resize(int(cfg["layout_cache_mb"]) * MB)
+    if "tile_cache_mb" in cfg: tile_cache.resize(int(cfg["tile_cache_mb"]) * MB)
+    if "background_cache_mb" in cfg: background_cache.resize(int(cfg["background_cache_mb"]) * MB)
+
+
+def take_counters() -> Dict[str, int]:
+    """
+    取出本进程各缓存上次调用以来的计数并清零；渲染进程随任务结果交回主进程累加，
+    每次计数只被取出一次，线程模式下并发任务的计数也不会重复
+    """
+    counters = {}
+    for c in (font_cache, image_cache, layout_cache, tile_cache, background_cache):
+        counters.update(c.take_counters())
+    return counters
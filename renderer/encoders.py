@@ -0,0 +1,287 @@
+import io
+import struct
+import zlib
+import imageio_ffmpeg
+import numpy as np
+from PIL import Image
+from pathlib import Path
+from typing import List, Optional, Tuple
+
+# 菜单字段 video_encoder 的可选值
+ENCODER_BACKENDS = ("auto", "delta", "ffmpeg", "pillow")
+# auto 时各格式使用的后端（依据各格式编码耗时/体积对比选择）；delta 仅支持 APNG
+AUTO_BACKEND = {"apng": "delta", "webp": "pillow", "gif": "pillow"}
+
+WEBP_QUALITY = 60
+WEBP_METHOD = 6
+# 关键帧间隔上限，0 表示不强制插入关键帧（Pillow 有损默认每 5 帧插入一个整幅画布的关键帧）
+WEBP_KMAX = 0
+GIF_COLORS = 256
+# 共享调色板由最先到达的 GIF_PALETTE_FRAMES 帧中均匀抽取的 GIF_PALETTE_SAMPLES 帧统计
+GIF_PALETTE_FRAMES = 32
+GIF_PALETTE_SAMPLES = 8
+# APNG fcTL 的 blend_op
+APNG_BLEND_SOURCE = 0
+APNG_BLEND_OVER = 1
+# fcTL 的帧延时分子为 16 位无符号数（分母 1000 时即毫秒）
+APNG_MAX_DELAY = 65535
+
+
+class AnimationEncoder:
+    """
+    动图编码器：append 逐帧写入，调用返回后帧缓冲区即被复用；close 完成封装并写出文件；
+    出错时调用 abort 释放资源（输出文件不完整，由调用方删除）
+    """
+
+    def __init__(self, path: Path, fmt: str, fps: float, size: Tuple[int, int], quality: Optional[int] = None):
+        self.path = Path(path)
+        self.fmt = fmt
+        self.fps = max(1.0, float(fps))
+        self.size = tuple(size)
+        # 有损格式（WebP）的质量，None 时使用 WEBP_QUALITY
+        self.quality = int(quality) if quality else WEBP_QUALITY
+        self.frames = 0
+
+    @property
+    def duration_ms(self) -> int:
+        return int(round(1000 / self.fps))
+
+    def append(self, frame: np.ndarray):
+        raise NotImplementedError
+
+    def close(self):
+        pass
+
+    def abort(self):
+        pass
+
+
+class FfmpegEncoder(AnimationEncoder):
+    """通过管道交给 ffmpeg 逐帧编码，直接写出目标容器，不在内存中保留帧"""
+
+    def __init__(self, path: Path, fmt: str, fps: float, size: Tuple[int, int], quality: Optional[int] = None):
+        super().__init__(path, fmt, fps, size, quality)
+        if fmt == "apng":
+            codec, pix_fmt, params = "apng", "rgba", ["-f", "apng", "-pred", "mixed", "-plays", "0"]
+        elif fmt == "webp":
+            codec, pix_fmt = "libwebp_anim", "yuva420p"
+            params = ["-f", "webp", "-quality", str(self.quality), "-compression_level", str(WEBP_METHOD),
+                      "-loop", "0"]
+        elif fmt == "gif":
+            # 单次编码内生成全片共享调色板
+            codec, pix_fmt = "gif", "pal8"
+            params = ["-vf", f"split[a][b];[a]palettegen=max_colors={GIF_COLORS}:stats_mode=full[p];"
+                             f"[b][p]paletteuse=dither=sierra2_4a", "-f", "gif", "-loop", "0"]
+        else:
+            raise ValueError(f"ffmpeg 编码器不支持格式: {fmt}")
+        self._gen = imageio_ffmpeg.write_frames(
+            str(self.path), self.size, pix_fmt_in="rgba", pix_fmt_out=pix_fmt, fps=self.fps, codec=codec,
+            quality=None, macro_block_size=1, ffmpeg_log_level="error", output_params=params)
+        self._gen.send(None)
+
+    def append(self, frame: np.ndarray):
+        self._gen.send(frame)
+        self.frames += 1
+
+    def close(self):
+        gen, self._gen = self._gen, None
+        if gen is not None: gen.close()
+
+    def abort(self):
+        self.close()
+
+
+class PillowEncoder(AnimationEncoder):
+    """
+    Pillow 原生 save_all 编码（APNG/WebP/GIF）
+    WebP/APNG 需要在 close 时一次性拿到全部帧；GIF 在写入时即按共享调色板量化为 P 模式，内存占用为 RGBA 的 1/4
+    """
+
+    def __init__(self, path: Path, fmt: str, fps: float, size: Tuple[int, int], quality: Optional[int] = None):
+        super().__init__(path, fmt, fps, size, quality)
+        if fmt not in ("apng", "webp", "gif"):
+            raise ValueError(f"Pillow 编码器不支持格式: {fmt}")
+        self._images: List[Image.Image] = []
+        self._palette: Optional[Image.Image] = None
+        self._samples: List[Image.Image] = []
+
+    def append(self, frame: np.ndarray):
+        img = Image.fromarray(frame, "RGBA").copy()
+        if self.fmt == "gif":
+            self._append_gif(img)
+        else:
+            self._images.append(img)
+        self.frames += 1
+
+    def _append_gif(self, img: Image.Image):
+        if self._palette is not None:
+            self._images.append(self._quantize(img))
+            return
+        self._samples.append(img)
+        if len(self._samples) >= GIF_PALETTE_FRAMES: self._flush_samples()
+
+    def _flush_samples(self):
+        """用已缓存的帧拼图生成共享调色板，再量化这些帧"""
+        if not self._samples: return
+        w, h = self.size
+        stride = max(1, len(self._samples) // GIF_PALETTE_SAMPLES)
+        picked = self._samples[::stride][:GIF_PALETTE_SAMPLES]
+        mosaic = Image.new("RGB", (w, h * len(picked)))
+        for i, s in enumerate(picked):
+            mosaic.paste(s.convert("RGB"), (0, h * i))
+        # 拼图过大时先缩小，调色板统计不需要全分辨率
+        if mosaic.width * mosaic.height > 4_000_000:
+            ratio = (4_000_000 / (mosaic.width * mosaic.height)) ** 0.5
+            mosaic = mosaic.resize((max(1, int(mosaic.width * ratio)), max(1, int(mosaic.height * ratio))),
+                                   Image.Resampling.NEAREST)
+        self._palette = mosaic.quantize(colors=GIF_COLORS, method=Image.Quantize.FASTOCTREE)
+        samples, self._samples = self._samples, []
+        self._images.extend(self._quantize(s) for s in samples)
+
+    def _quantize(self, img: Image.Image) -> Image.Image:
+        return img.convert("RGB").quantize(palette=self._palette, dither=Image.Dither.NONE)
+
+    def close(self):
+        if self.fmt == "gif": self._flush_samples()
+        images, self._images = self._images, []
+        if not images: return
+        first, rest = images[0], images[1:]
+        if self.fmt == "apng":
+            first.save(self.path, format="PNG", save_all=True, append_images=rest, duration=self.duration_ms,
+                       loop=0, disposal=0, blend=0)
+        elif self.fmt == "webp":
+            first.save(self.path, format="WEBP", save_all=True, append_images=rest, duration=self.duration_ms,
+                       loop=0, quality=self.quality, method=WEBP_METHOD, lossless=False, kmin=0, kmax=WEBP_KMAX)
+        else:
+            first.save(self.path, format="GIF", save_all=True, append_images=rest, duration=self.duration_ms,
+                       loop=0, optimize=False)
+
+    def abort(self):
+        self._images, self._samples = [], []
+
+
+class ApngDeltaEncoder(AnimationEncoder):
+    """
+    流式 APNG 编码：首帧写出整幅画布，之后每帧只写出与上一帧相比变化区域的外接矩形（fcTL + fdAT），
+    变化像素均不透明时矩形内未变化的像素置为全透明并以 OVER 方式叠加，压缩率更高；
+    与上一帧相同的帧合并为一帧并延长显示时间；帧数据逐帧压缩写入文件，不在内存中保留帧
+    dirty_region 为帧间可能变化的区域 (x1, y1, x2, y2)，只在其中比较像素，None 表示整幅画布
+    """
+
+    def __init__(self, path: Path, fmt: str, fps: float, size: Tuple[int, int], quality: Optional[int] = None,
+                 dirty_region: Optional[Tuple[int, int, int, int]] = None):
+        super().__init__(path, fmt, fps, size, quality)
+        if fmt != "apng":
+            raise ValueError(f"增量帧编码器不支持格式: {fmt}")
+        w, h = self.size
+        x1, y1, x2, y2 = dirty_region or (0, 0, w, h)
+        x1, y1 = max(0, x1), max(0, y1)
+        self._region = (x1, y1, max(x1, min(w, x2)), max(y1, min(h, y2)))
+        self._prev: Optional[np.ndarray] = None
+        # 尚未写出的帧 [x, y, 宽, 高, 叠加方式, 压缩数据, 持续帧数]，等到下一帧不同或结束时才能确定显示时间
+        self._pending = None
+        self._seq = 0
+        self._written = 0
+        self._shown = 0
+        self._file = open(self.path, "wb")
+        self._file.write(b"\x89PNG\r\n\x1a\n")
+        self._chunk(b"IHDR", struct.pack(">IIBBBBB", w, h, 8, 6, 0, 0, 0))
+        # 帧数在结束时回填
+        self._actl_pos = self._file.tell()
+        self._chunk(b"acTL", struct.pack(">II", 0, 0))
+
+    def _chunk(self, tag: bytes, data: bytes):
+        self._file.write(struct.pack(">I", len(data)) + tag + data +
+                         struct.pack(">I", zlib.crc32(data, zlib.crc32(tag)) & 0xffffffff))
+
+    @staticmethod
+    def _compress(pixels: np.ndarray) -> bytes:
+        """借助 Pillow 的 PNG 编码器完成逐行滤波与压缩，取出其中的 IDAT 数据"""
+        buf = io.BytesIO()
+        Image.fromarray(np.ascontiguousarray(pixels), "RGBA").save(buf, format="PNG")
+        png, pos, parts = buf.getvalue(), 8, []
+        while pos < len(png):
+            length, tag = struct.unpack(">I4s", png[pos:pos + 8])
+            if tag == b"IDAT": parts.append(png[pos + 8:pos + 8 + length])
+            pos += 12 + length
+        return b"".join(parts)
+
+    def append(self, frame: np.ndarray):
+        x1, y1, x2, y2 = self._region
+        region = frame[y1:y2, x1:x2]
+        self.frames += 1
+        if self._prev is None:
+            self._prev = region.copy()
+            self._pending = [0, 0, self.size[0], self.size[1], APNG_BLEND_SOURCE, self._compress(frame), 1]
+            return
+        # 按像素（4 字节）比较
+        changed = region.view(np.uint32)[..., 0] != self._prev.view(np.uint32)[..., 0]
+        rows = np.flatnonzero(changed.any(axis=1))
+        if not rows.size:
+            if self._delay(self._pending[6] + 1) <= APNG_MAX_DELAY:
+                self._pending[6] += 1
+            else:
+                # 合并后的显示时间超出 fcTL 可表示的范围：另起一个 1x1 全透明的空帧接着计时，画面不变
+                self._flush()
+                self._pending = [0, 0, 1, 1, APNG_BLEND_OVER, self._compress(np.zeros((1, 1, 4), np.uint8)), 1]
+            return
+        cols = np.flatnonzero(changed.any(axis=0))
+        r0, r1, c0, c1 = int(rows[0]), int(rows[-1]) + 1, int(cols[0]), int(cols[-1]) + 1
+        sub, mask = region[r0:r1, c0:c1], changed[r0:r1, c0:c1]
+        self._prev[r0:r1, c0:c1] = sub
+        blend = APNG_BLEND_SOURCE
+        if (sub[..., 3][mask] == 255).all():
+            sub, blend = np.where(mask[..., None], sub, np.uint8(0)), APNG_BLEND_OVER
+        self._flush()
+        self._pending = [x1 + c0, y1 + r0, c1 - c0, r1 - r0, blend, self._compress(sub), 1]
+
+    def _delay(self, count: int) -> int:
+        """从已写出的帧之后开始、持续 count 帧的显示时间（毫秒），按累计时间取整，避免逐帧舍入误差累积"""
+        return max(1, int(round(1000 * (self._shown + count) / self.fps)) - int(round(1000 * self._shown / self.fps)))
+
+    def _flush(self):
+        if self._pending is None: return
+        x, y, w, h, blend, data, count = self._pending
+        self._pending = None
+        delay = min(APNG_MAX_DELAY, self._delay(count))
+        self._shown += count
+        self._chunk(b"fcTL", struct.pack(">IIIIIHHBB", self._seq, w, h, x, y, delay, 1000, 0, blend))
+        self._seq += 1
+        if self._written == 0:
+            self._chunk(b"IDAT", data)
+        else:
+            self._chunk(b"fdAT", struct.pack(">I", self._seq) + data)
+            self._seq += 1
+        self._written += 1
+
+    def close(self):
+        f = self._file
+        if f is None: return
+        try:
+            self._flush()
+            self._chunk(b"IEND", b"")
+            f.seek(self._actl_pos)
+            self._chunk(b"acTL", struct.pack(">II", max(1, self._written), 0))
+        finally:
+            self._file = None
+            f.close()
+
+    def abort(self):
+        self._pending = None
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+
+
+def create_encoder(path: Path, fmt: str, fps: float, size: Tuple[int, int], backend: str = "auto",
+                   quality: Optional[int] = None,
+                   dirty_region: Optional[Tuple[int, int, int, int]] = None) -> AnimationEncoder:
+    """按格式与菜单指定的后端创建编码器；未知格式按 APNG 处理，dirty_region 供增量帧编码器限定比较区域"""
+    fmt = (fmt or "apng").lower()
+    if fmt not in AUTO_BACKEND: fmt = "apng"
+    backend = (backend or "auto").lower()
+    if backend not in ENCODER_BACKENDS or backend == "auto" or (backend == "delta" and fmt != "apng"):
+        backend = AUTO_BACKEND[fmt]
+    if backend == "delta": return ApngDeltaEncoder(path, fmt, fps, size, quality, dirty_region)
+    if backend == "ffmpeg": return FfmpegEncoder(path, fmt, fps, size, quality)
+    return PillowEncoder(path, fmt, fps, size, quality)
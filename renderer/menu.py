@@ -1,9 +1,14 @@
+import os
+import json
+import math
+import hashlib
+import time
+import uuid
 import traceback
-import imageio
 import numpy as np
-from PIL import Image, ImageDraw, ImageFont, ImageFilter
+from PIL import Image, ImageDraw, ImageFont
 from pathlib import Path
-from typing import Optional, Tuple
+from typing import NamedTuple, Optional, Tuple
 
 try:
     from astrbot.api import logger
@@ -13,6 +18,12 @@ except ImportError:
     logger = logging.getLogger(__name__)
 
 from ..storage import plugin_storage
+from .blur import blur_box, blur_padding, blurred_rect
+from .cache import background_cache, font_cache, image_cache, layout_cache, tile_cache
+from .text import wrap_text_to_width
+from .encoders import WEBP_QUALITY, create_encoder
+from .video import (VideoCompositor, composite_stream, load_video_proxy, probe_video, read_video_frames,
+                    select_frame_range)
 
 # --- Constants ---
 BASE_PADDING_X = 40
@@ -20,16 +31,73 @@ BASE_GROUP_GAP = 30
 BASE_ITEM_H = 90
 BASE_ITEM_GAP_X = 15
 BASE_ITEM_GAP_Y = 15
+# 视频导出时并行合成帧的线程数，单核主机上不使用流水线线程
+VIDEO_COMPOSITE_WORKERS = min(2, (os.cpu_count() or 1) - 1)
+VIDEO_MAX_FRAMES = 300
+# 体积预算：探测轮数、每轮探测的段数与每段帧数、估算余量，以及自适应调整的下限
+BUDGET_PROBE_ROUNDS = 3
+BUDGET_PROBE_RUNS = 2
+BUDGET_PROBE_FRAMES = 8
+BUDGET_SAFETY = 0.85
+BUDGET_MIN_FPS = 6
+BUDGET_MIN_SCALE = 0.6
+BUDGET_MIN_WEBP_QUALITY = 35
+
+
+def _default_font():
+    font = font_cache.get(("<default>",))
+    if font is None:
+        font = ImageFont.load_default()
+        font_cache.put(("<default>",), font, 0)
+    return font
 
 
 def load_font(font_name: str, size: int) -> ImageFont.FreeTypeFont:
-    if not font_name or not plugin_storage.fonts_dir: return ImageFont.load_default()
+    """加载字体，按 (字体文件, 字号, 文件 mtime) 缓存字体对象，按文件大小估算占用"""
+    if not font_name or not plugin_storage.fonts_dir: return _default_font()
     font_path = plugin_storage.fonts_dir / font_name
     try:
-        if font_path.exists(): return ImageFont.truetype(str(font_path), int(size))
-        return ImageFont.load_default()
-    except:
-        return ImageFont.load_default()
+        st = font_path.stat()
+    except OSError:
+        return _default_font()
+    key = (str(font_path), int(size), st.st_mtime_ns)
+    font = font_cache.get(key)
+    if font is None:
+        try:
+            font = ImageFont.truetype(str(font_path), int(size))
+        except:
+            return _default_font()
+        font_cache.put(key, font, st.st_size)
+    return font
+
+
+def get_image_size(path: Path) -> Tuple[int, int]:
+    """读取图片尺寸（只解析文件头），按 (路径, mtime) 缓存"""
+    st = path.stat()
+    key = ("size", str(path), st.st_mtime_ns)
+    size = image_cache.get(key)
+    if size is None:
+        with Image.open(path) as img:
+            size = img.size
+        image_cache.put(key, size, 64)
+    return size
+
+
+def load_image(path: Path, size: Optional[Tuple[int, int]] = None) -> Image.Image:
+    """
+    解码为 RGBA 并按需 LANCZOS 缩放到目标尺寸，按 (路径, mtime, 目标尺寸) 缓存
+    返回的图片在多次渲染间共享，调用方只能读取（paste 源/蒙版），不能修改
+    """
+    st = path.stat()
+    key = ("rgba", str(path), st.st_mtime_ns, tuple(size) if size else None)
+    img = image_cache.get(key)
+    if img is None:
+        with Image.open(path) as src:
+            img = src.convert("RGBA")
+        if size and img.size != tuple(size):
+            img = img.resize(tuple(size), Image.Resampling.LANCZOS)
+        image_cache.put(key, img, img.width * img.height * 4)
+    return img
 
 
 def hex_to_rgb(hex_color):
@@ -136,104 +204,57 @@ def draw_glass_rect(base_img: Image.Image, box: tuple, color_hex: str, alpha: in
     x2 = max(0, min(x2, img_w))
     y2 = max(0, min(y2, img_h))
 
-    if apply_blur and radius > 0 and x2 > x1 and y2 > y1:
-        # 裁剪出需要模糊的区域
-        region = base_img.crop((x1, y1, x2, y2))
-        blurred_region = region.filter(ImageFilter.GaussianBlur(radius=radius))
-        base_img.paste(blurred_region, (x1, y1))
+    blurred = blur_box(base_img, (x1, y1, x2, y2), radius) if apply_blur else None
+    if blurred:
+        base_img.paste(*blurred)
 
-    # 绘制半透明的颜色叠加层
-    overlay = Image.new("RGBA", base_img.size, (0, 0, 0, 0))
-    draw = ImageDraw.Draw(overlay)
-    draw.rounded_rectangle(box, radius=corner_r, fill=hex_to_rgb(color_hex) + (int(alpha),))
-    base_img.alpha_composite(overlay)
+    # 绘制半透明的颜色叠加层：只在矩形大小的局部图块上绘制，并只合成画布内可见的部分
+    rx1, ry1, rx2, ry2 = [int(v) for v in box]
+    if int(alpha) <= 0 or rx2 < rx1 or ry2 < ry1: return
+    vx1, vy1 = max(0, rx1), max(0, ry1)
+    vx2, vy2 = min(img_w, rx2 + 1), min(img_h, ry2 + 1)
+    if vx2 <= vx1 or vy2 <= vy1: return
 
+    tile = Image.new("RGBA", (rx2 - rx1 + 1, ry2 - ry1 + 1), (0, 0, 0, 0))
+    draw = ImageDraw.Draw(tile)
+    draw.rounded_rectangle((0, 0, rx2 - rx1, ry2 - ry1), radius=corner_r, fill=hex_to_rgb(color_hex) + (int(alpha),))
+    base_img.alpha_composite(tile, dest=(vx1, vy1), source=(vx1 - rx1, vy1 - ry1, vx2 - rx1, vy2 - ry1))
 
-def wrap_text_to_width(text: str, font, max_width: int, draw) -> str:
-    """将文本根据最大宽度自动换行"""
-    if not text or max_width <= 0:
-        return text
-    
-    # 如果已经有手动换行，分别处理每一行
-    lines = text.split('\n')
-    wrapped_lines = []
-    
-    for line in lines:
-        if not line:
-            wrapped_lines.append('')
-            continue
-            
-        # 计算当前行宽度
-        try:
-            if hasattr(draw, 'textbbox'):
-                line_width = draw.textbbox((0, 0), line, font=font)[2]
-            else:
-                line_width = draw.textsize(line, font=font)[0]
-        except:
-            line_width = len(line) * 20
-        
-        # 如果不超过最大宽度，直接添加
-        if line_width <= max_width:
-            wrapped_lines.append(line)
-            continue
-        
-        # 需要换行
-        current_line = ''
-        for char in line:
-            test_line = current_line + char
-            try:
-                if hasattr(draw, 'textbbox'):
-                    test_width = draw.textbbox((0, 0), test_line, font=font)[2]
-                else:
-                    test_width = draw.textsize(test_line, font=font)[0]
-            except:
-                test_width = len(test_line) * 20
-            
-            if test_width <= max_width:
-                current_line = test_line
-            else:
-                if current_line:
-                    wrapped_lines.append(current_line)
-                current_line = char
-        
-        if current_line:
-            wrapped_lines.append(current_line)
-    
-    return '\n'.join(wrapped_lines)
 
-
-def render_item_content(overlay_img, draw, item, box, fonts_map, shadow_cfg, menu_data, scale):
+def _layout_item_content(item, box, name_font, desc_font, measure, scale, deps):
+    """功能项内容排版：图标位置、名称/描述的起点与描述换行"""
     x, y, x2, y2 = box
     w, h = x2 - x, y2 - y
     icon_name = item.get("icon", "")
+    icon = None
     text_start_x = x + int(15 * scale)
     text_max_width = w - int(30 * scale)  # 文本最大宽度
 
     if icon_name and plugin_storage.icon_dir:
         icon_path = plugin_storage.icon_dir / icon_name
+        _record_dep(deps, icon_path)
         if icon_path.exists():
             try:
-                with Image.open(icon_path).convert("RGBA") as icon_img:
-                    custom_icon_size = item.get("icon_size")
-                    target_h = int(int(custom_icon_size) * scale) if custom_icon_size and int(
-                        custom_icon_size) > 0 else int(h * 0.6)
-                    aspect_ratio = icon_img.width / icon_img.height if icon_img.height > 0 else 1
-                    target_w = int(target_h * aspect_ratio)
-                    icon_resized = icon_img.resize((target_w, target_h), Image.Resampling.LANCZOS)
-                    icon_x, icon_y = x + int(15 * scale), y + (h - icon_resized.height) // 2
-                    overlay_img.paste(icon_resized, (icon_x, icon_y), icon_resized)
-                    text_start_x = icon_x + icon_resized.width + int(12 * scale)
-                    text_max_width = x2 - text_start_x - int(15 * scale)  # 更新文本最大宽度
+                icon_w, icon_h = get_image_size(icon_path)
+                custom_icon_size = item.get("icon_size")
+                target_h = int(int(custom_icon_size) * scale) if custom_icon_size and int(
+                    custom_icon_size) > 0 else int(h * 0.6)
+                aspect_ratio = icon_w / icon_h if icon_h > 0 else 1
+                target_w = int(target_h * aspect_ratio)
+                icon_resized = load_image(icon_path, (target_w, target_h))
+                icon_x, icon_y = x + int(15 * scale), y + (h - icon_resized.height) // 2
+                icon = [icon_name, icon_x, icon_y, icon_resized.width, icon_resized.height]
+                text_start_x = icon_x + icon_resized.width + int(12 * scale)
+                text_max_width = x2 - text_start_x - int(15 * scale)  # 更新文本最大宽度
             except:
                 pass
 
     name, desc = item.get("name", ""), item.get("desc", "")
-    name_font, desc_font = fonts_map["name"], fonts_map["desc"]
     line_spacing = int(4 * scale)
-    
+
     # 自动换行处理
     if desc and text_max_width > 0:
-        desc = wrap_text_to_width(desc, desc_font, text_max_width, draw)
+        desc = wrap_text_to_width(desc, desc_font, text_max_width, measure)
 
     try:
         if hasattr(name_font, "getbbox"):
@@ -249,28 +270,46 @@ def render_item_content(overlay_img, draw, item, box, fonts_map, shadow_cfg, men
     try:
         desc_h = 0
         if desc:
-            if hasattr(draw, "multiline_textbbox"):
-                desc_h = draw.multiline_textbbox((0, 0), desc, font=desc_font, spacing=line_spacing)[3] - \
-                         draw.multiline_textbbox((0, 0), desc, font=desc_font, spacing=line_spacing)[1]
+            if hasattr(measure, "multiline_textbbox"):
+                bbox = measure.multiline_textbbox((0, 0), desc, font=desc_font, spacing=line_spacing)
+                desc_h = bbox[3] - bbox[1]
             else:
-                desc_h = draw.multiline_textsize(desc, font=desc_font, spacing=line_spacing)[1]
+                desc_h = measure.multiline_textsize(desc, font=desc_font, spacing=line_spacing)[1]
     except:
         desc_h = 0
 
     gap = int(5 * scale)
     total_text_height = name_h + (desc_h + gap if desc else 0)
     text_start_y = y + (h - total_text_height) / 2
-    
+    return {"icon": icon, "name_pos": [text_start_x, text_start_y],
+            "desc_pos": [text_start_x, text_start_y + name_h + gap], "desc": desc,
+            "top": min(y, int(math.floor(text_start_y))),
+            "bottom": max(y2 + 1, int(math.ceil(text_start_y + total_text_height)))}
+
+
+def render_item_content(overlay_img, draw, item, item_layout, fonts_map, menu_data, scale):
+    """按排版结果绘制功能项的图标、名称与描述"""
+    icon = item_layout["icon"]
+    if icon:
+        try:
+            icon_name, icon_x, icon_y, icon_w, icon_h = icon
+            icon_resized = load_image(plugin_storage.icon_dir / icon_name, (icon_w, icon_h))
+            overlay_img.paste(icon_resized, (icon_x, icon_y), icon_resized)
+        except:
+            pass
+
+    name, desc = item.get("name", ""), item_layout["desc"]
     # 获取功能项名称和描述的阴影配置和样式
     name_shadow = get_shadow_config(item, menu_data, 'item_name')
     desc_shadow = get_shadow_config(item, menu_data, 'item_desc')
     name_styles = get_text_style_str(item, 'item_name')
     desc_styles = get_text_style_str(item, 'item_desc')
 
-    if name: draw_text_with_shadow(draw, (text_start_x, text_start_y), name, name_font, fonts_map["name_color"],
-                                   name_shadow, scale=scale, text_styles=name_styles)
-    if desc: draw_text_with_shadow(draw, (text_start_x, text_start_y + name_h + gap), desc, desc_font,
-                                   fonts_map["desc_color"], desc_shadow, spacing=line_spacing, scale=scale, text_styles=desc_styles)
+    if name: draw_text_with_shadow(draw, tuple(item_layout["name_pos"]), name, fonts_map["name"],
+                                   fonts_map["name_color"], name_shadow, scale=scale, text_styles=name_styles)
+    if desc: draw_text_with_shadow(draw, tuple(item_layout["desc_pos"]), desc, fonts_map["desc"],
+                                   fonts_map["desc_color"], desc_shadow, spacing=int(4 * scale), scale=scale,
+                                   text_styles=desc_styles)
 
 
 def get_style(obj: dict, menu: dict, key: str, fallback_key: str, default=None):
@@ -359,13 +398,73 @@ def _calculate_bg_layout(src_w: int, src_h: int, canvas_w: int, canvas_h: int,
     return final_w, final_h, px, py
 
 
-def _render_layout(menu_data: dict, is_video_mode: bool) -> Image.Image:
+# 只影响绘制、不影响排版的字段（菜单/分组/功能项上的同名字段均适用），修改它们时复用缓存的排版结果
+_PAINT_FIELD_SUFFIXES = ("_color", "_alpha", "_bold", "_italic", "_underline")
+_PAINT_FIELD_MARKERS = ("shadow", "blur")
+
+
+def _is_paint_field(key: str) -> bool:
+    return key.endswith(_PAINT_FIELD_SUFFIXES) or any(m in key for m in _PAINT_FIELD_MARKERS)
+
+
+def _strip_paint_fields(value):
+    if isinstance(value, dict):
+        return {k: _strip_paint_fields(v) for k, v in value.items() if not _is_paint_field(str(k))}
+    if isinstance(value, list):
+        return [_strip_paint_fields(v) for v in value]
+    return value
+
+
+def _layout_key(menu_data: dict, is_video_mode: bool) -> str:
+    raw = json.dumps([_strip_paint_fields(menu_data), bool(is_video_mode)], sort_keys=True, ensure_ascii=False,
+                     default=str)
+    return hashlib.sha1(raw.encode("utf-8")).hexdigest()
+
+
+def _file_mtime(path: Path) -> Optional[int]:
+    try:
+        return path.stat().st_mtime_ns
+    except OSError:
+        return None
+
+
+def _record_dep(deps: dict, path: Path):
+    """记录排版依赖的文件（字体/图标/背景）及其 mtime，文件不存在记为 None"""
+    key = str(path)
+    if key not in deps: deps[key] = _file_mtime(path)
+
+
+def compute_layout(menu_data: dict, is_video_mode: bool) -> dict:
+    """
+    排版阶段：只做测量（分组高度、文字换行、标题尺寸），返回可序列化的排版树
+    按排版相关字段缓存，依赖的字体/图标/背景文件 mtime 变化时重新排版
+    """
+    key = _layout_key(menu_data, is_video_mode)
+    layout = layout_cache.get(key)
+    if layout is not None and all(_file_mtime(Path(p)) == m for p, m in layout["deps"].items()):
+        return layout
+    layout = _compute_layout(menu_data, is_video_mode)
+    layout_cache.put(key, layout, len(json.dumps(layout, ensure_ascii=False)))
+    return layout
+
+
+def _compute_layout(menu_data: dict, is_video_mode: bool) -> dict:
     scale = float(menu_data.get("export_scale", 1.0))
     if scale <= 0: scale = 1.0
 
     def s(val):
         return int(val * scale)
 
+    deps = {}
+
+    def font_ref(font_name, size):
+        """字体引用 [文件名, 字号]，绘制阶段用 load_font 取回字体对象"""
+        if font_name and plugin_storage.fonts_dir: _record_dep(deps, plugin_storage.fonts_dir / font_name)
+        return [font_name, int(size)]
+
+    def font_of(ref):
+        return load_font(*ref)
+
     PADDING_X = s(BASE_PADDING_X)
     GROUP_GAP = s(BASE_GROUP_GAP)
     ITEM_H, ITEM_GAP_X, ITEM_GAP_Y = s(BASE_ITEM_H), s(BASE_ITEM_GAP_X), s(BASE_ITEM_GAP_Y)
@@ -378,44 +477,36 @@ def _render_layout(menu_data: dict, is_video_mode: bool) -> Image.Image:
     base_w = canvas_w_set if canvas_w_set > 0 else 1000
     final_w = s(base_w)
     columns = max(1, int(menu_data.get("layout_columns") or 3))
-
-    shadow_cfg = {
-        'enabled': menu_data.get('shadow_enabled', False),
-        'color': menu_data.get('shadow_color', '#000000'),
-        'offset_x': menu_data.get('shadow_offset_x', 2),
-        'offset_y': menu_data.get('shadow_offset_y', 2),
-        'radius': menu_data.get('shadow_radius', 2)
-    }
+    # 只用于测量文字的绘图对象
+    measure = ImageDraw.Draw(Image.new("RGBA", (1, 1)))
 
     title_size = s(int(menu_data.get("title_size") or 60))
     header_height = TITLE_TOP_MARGIN + title_size + s(10) + int(title_size * 0.5) + s(30)
     current_y, group_layout_info = header_height, []
-    blur_regions = []  # 收集所有需要磨砂的区域
 
     for group in menu_data.get("groups", []):
         is_free = group.get("free_mode", False)
         is_text_group = group.get("group_type") == "text"
         items, g_cols = group.get("items", []), group.get("layout_columns") or columns
         g_title_size = s(int(get_style(group, menu_data, 'title_size', 'group_title_size', 30)))
-        
+
         # 优化：如果分组没有标题，减少留白
         if not group.get("title"):
             box_start_y = current_y + s(10)
         else:
             box_start_y = current_y + g_title_size + s(20)
-        
+
         if is_text_group:
             # 纯文本分组 - 自适应高度
             text_content = group.get("text_content", "")
-            gsf = load_font(get_style(group, menu_data, 'sub_font', 'group_sub_font', 'text.ttf'),
-                           s(int(get_style(group, menu_data, 'sub_size', 'group_sub_size', 18))))
-            temp_draw = ImageDraw.Draw(Image.new("RGBA", (final_w - PADDING_X * 2, 1)))
-            
-            if hasattr(temp_draw, "multiline_textbbox"):
-                bbox = temp_draw.multiline_textbbox((0, 0), text_content, font=gsf, spacing=4)
+            gsf = font_of(font_ref(get_style(group, menu_data, 'sub_font', 'group_sub_font', 'text.ttf'),
+                                   s(int(get_style(group, menu_data, 'sub_size', 'group_sub_size', 18)))))
+
+            if hasattr(measure, "multiline_textbbox"):
+                bbox = measure.multiline_textbbox((0, 0), text_content, font=gsf, spacing=4)
                 content_h = bbox[3] - bbox[1] + s(40)
             else:
-                _, text_h = temp_draw.multiline_textsize(text_content, font=gsf, spacing=4)
+                _, text_h = measure.multiline_textsize(text_content, font=gsf, spacing=4)
                 content_h = text_h + s(40)
         elif is_free:
             max_bottom = max((s(int(item.get("y", 0))) + s(int(item.get("h", 100))) for item in items), default=0)
@@ -438,234 +529,412 @@ def _render_layout(menu_data: dict, is_video_mode: bool) -> Image.Image:
         final_h = content_final_h
         bg_aspect_h = 0
         if not is_video_mode and (bg_name := menu_data.get("background")) and plugin_storage.bg_dir:
+            _record_dep(deps, plugin_storage.bg_dir / bg_name)
             try:
-                with Image.open(plugin_storage.bg_dir / bg_name) as bg_img:
-                    if bg_img.width > 0:
-                        bg_aspect_h = int(final_w * (bg_img.height / bg_img.width))
+                bg_w, bg_h = get_image_size(plugin_storage.bg_dir / bg_name)
+                if bg_w > 0:
+                    bg_aspect_h = int(final_w * (bg_h / bg_w))
             except:
                 pass
         if bg_aspect_h > final_h: final_h = bg_aspect_h
 
-    overlay = Image.new("RGBA", (final_w, final_h), (0, 0, 0, 0))
-    draw_ov = ImageDraw.Draw(overlay)
-
-    tf = load_font(menu_data.get("title_font", "title.ttf"), title_size)
-    sf = load_font(menu_data.get("subtitle_font") or menu_data.get("title_font", "title.ttf"), int(title_size * 0.5))
     al = menu_data.get("title_align", "center")
-    tx = {"left": PADDING_X, "right": final_w - PADDING_X, "center": final_w / 2}[al]
-    anc = {"left": "lt", "right": "rt", "center": "mt"}[al]
-    
-    # 获取主标题的阴影配置和样式
-    title_shadow = get_shadow_config(menu_data, menu_data, 'title')
-    title_styles = get_text_style_str(menu_data, 'title')
-    draw_text_with_shadow(draw_ov, (tx, TITLE_TOP_MARGIN), menu_data.get("title", ""), tf,
-                          hex_to_rgb(menu_data.get("title_color") or "#FFFFFF"), title_shadow, anchor=anc, scale=scale, text_styles=title_styles)
-    
-    # 获取副标题的阴影配置和样式
-    subtitle_shadow = get_shadow_config(menu_data, menu_data, 'subtitle')
-    subtitle_styles = get_text_style_str(menu_data, 'subtitle')
-    draw_text_with_shadow(draw_ov, (tx, TITLE_TOP_MARGIN + title_size + s(10)), menu_data.get("sub_title", ""), sf,
-                          hex_to_rgb(menu_data.get("subtitle_color") or "#FFFFFF"), subtitle_shadow, anchor=anc, scale=scale, text_styles=subtitle_styles)
+    header = {
+        "font": font_ref(menu_data.get("title_font", "title.ttf"), title_size),
+        "sub_font": font_ref(menu_data.get("subtitle_font") or menu_data.get("title_font", "title.ttf"),
+                             int(title_size * 0.5)),
+        "x": {"left": PADDING_X, "right": final_w - PADDING_X, "center": final_w / 2}[al],
+        "anchor": {"left": "lt", "right": "rt", "center": "mt"}[al],
+        "y": TITLE_TOP_MARGIN,
+        "sub_y": TITLE_TOP_MARGIN + title_size + s(10),
+    }
 
+    groups = []
     for g_info in group_layout_info:
         grp = g_info["data"]
         bx, by, bx2, by2 = g_info["box_rect"]
         bw = bx2 - bx
-        is_text_group = g_info.get("is_text_group", False)
-        
-        # 使用分组自定义模糊半径或全局模糊半径
-        group_blur = int(get_style(grp, menu_data, 'blur_radius', 'group_blur_radius', 0) or 0)
-        
+
         # 处理分组自定义大小
         group_custom_w = grp.get("custom_width") or menu_data.get("group_custom_width")
         group_custom_h = grp.get("custom_height") or menu_data.get("group_custom_height")
-        
+
         # 如果设置了自定义大小，使用自定义大小；否则使用计算的矩形
         if group_custom_w and group_custom_h:
             bx2 = bx + s(int(group_custom_w))
             by2 = by + s(int(group_custom_h))
             bw = bx2 - bx
 
-        # 收集磨砂区域信息，稍后在有背景时处理
-        if group_blur > 0:
-            blur_regions.append({
-                'box': (bx, by, bx2, by2),
-                'radius': group_blur,
-                'corner_r': s(15)
-            })
-        # 只绘制半透明层，不做模糊
-        draw_glass_rect(overlay, (bx, by, bx2, by2), get_style(grp, menu_data, 'bg_color', 'group_bg_color', '#000000'),
-                        get_style(grp, menu_data, 'bg_alpha', 'group_bg_alpha', 50),
-                        group_blur, corner_r=s(15), apply_blur=False)
-
-        gtf = load_font(get_style(grp, menu_data, 'title_font', 'group_title_font', 'text.ttf'),
-                        s(int(get_style(grp, menu_data, 'title_size', 'group_title_size', 30))))
-        gsf = load_font(get_style(grp, menu_data, 'sub_font', 'group_sub_font', 'text.ttf'),
-                        s(int(get_style(grp, menu_data, 'sub_size', 'group_sub_size', 18))))
-
-        title_text = grp.get("title", "")
-        sub_text = grp.get("subtitle", "")
+        title_font = font_ref(get_style(grp, menu_data, 'title_font', 'group_title_font', 'text.ttf'),
+                              s(int(get_style(grp, menu_data, 'title_size', 'group_title_size', 30))))
+        sub_font = font_ref(get_style(grp, menu_data, 'sub_font', 'group_sub_font', 'text.ttf'),
+                            s(int(get_style(grp, menu_data, 'sub_size', 'group_sub_size', 18))))
         ty = g_info["title_y"] + s(10)
         title_x = bx + s(10)
-        
-        # 获取分组标题的阴影配置和样式
-        group_title_shadow = get_shadow_config(grp, menu_data, 'group_title')
-        group_title_styles = get_text_style_str(grp, 'group_title')
+        g = {"box": [bx, by, bx2, by2], "title_font": title_font, "title_pos": [title_x, ty],
+             "text": None, "sub_font": sub_font, "sub_pos": None, "items": []}
 
-        draw_text_with_shadow(draw_ov, (title_x, ty), title_text, gtf,
-                              hex_to_rgb(get_style(grp, menu_data, 'title_color', 'group_title_color', '#FFFFFF')),
-                              group_title_shadow, scale=scale, text_styles=group_title_styles)
-
-        if is_text_group:
-            # 纯文本分组处理
+        if g_info["is_text_group"]:
+            # 纯文本分组：字体、大小优先从分组属性读取，再从全局设置读取
             text_content = grp.get("text_content", "")
             text_y = by + s(20)
             text_x = bx + s(20)
             max_text_width = bx2 - text_x - s(20)
-            
-            # 获取纯文本的字体、颜色、大小 - 优先从分组属性读取，再从全局设置读取
             text_font_name = grp.get("text_font") or menu_data.get("group_sub_font", "text.ttf")
             text_font_size_val = grp.get("text_size")
             if text_font_size_val:
                 text_font_size = int(text_font_size_val)
             else:
                 text_font_size = int(menu_data.get("group_sub_size", 30))
-            
-            # 获取文本样式（粗体、斜体、下划线）
-            text_bold = grp.get("text_bold", False)
-            text_italic = grp.get("text_italic", False)
-            text_underline = grp.get("text_underline", False)
-            
-            text_font = load_font(text_font_name, s(text_font_size))
-            text_color_hex = grp.get("text_color") or menu_data.get("group_sub_color", '#AAAAAA')
-            text_color = hex_to_rgb(text_color_hex)
-            
-            # 绘制纯文本内容，支持自动换行
+            text_font = font_ref(text_font_name, s(text_font_size))
+
+            # 支持自动换行
             if text_content and max_text_width > 0:
-                text_content = wrap_text_to_width(text_content, text_font, max_text_width, draw_ov)
-            
-            # 获取纯文本的阴影配置
-            text_shadow = get_shadow_config(grp, menu_data, 'group_sub')
-            
-            # 获取纯文本的背景毛玻璃效果配置
-            text_bg_color = grp.get("text_bg_color") or menu_data.get("group_sub_bg_color", "#333333")
-            text_bg_alpha = int(grp.get("text_bg_alpha", menu_data.get("group_sub_bg_alpha", 200)))
-            text_bg_blur = int(grp.get("text_bg_blur", menu_data.get("group_sub_bg_blur", 5)))
-            
-            # 获取纯文本的对齐方式
-            text_align = grp.get("text_align", "left")
-
-            # 如果启用背景毛玻璃效果，先绘制背景
-            if text_bg_alpha > 0 and text_bg_blur >= 0:
-                # 计算背景区域（文本周围留一些边距）
-                bg_padding = s(10)
-                bg_x1 = max(bx, text_x - bg_padding)
-                bg_y1 = max(by, text_y - bg_padding)
-                bg_x2 = min(bx2, text_x + max_text_width + bg_padding)
-                bg_y2 = min(by2, text_y + s(100) + bg_padding)  # 假设最大高度
-                
-                # 绘制背景矩形 (毛玻璃效果)
-                bg_rgb = hex_to_rgb(text_bg_color)
-                if text_bg_blur > 0:
-                    # 模糊背景 (使用简单的半透明填充模拟毛玻璃)
-                    blur_image = Image.new('RGBA', (overlay.width, overlay.height), (0, 0, 0, 0))
-                    blur_draw = ImageDraw.Draw(blur_image)
-                    blur_draw.rectangle([(bg_x1, bg_y1), (bg_x2, bg_y2)], 
-                                       fill=(bg_rgb[0], bg_rgb[1], bg_rgb[2], text_bg_alpha))
-                    
-                    # 对模糊图像应用高斯模糊
-                    blur_image = blur_image.filter(ImageFilter.GaussianBlur(radius=text_bg_blur))
-                    overlay.paste(blur_image, (0, 0), blur_image)
-                else:
-                    # 不模糊，直接填充
-                    draw_ov.rectangle([(bg_x1, bg_y1), (bg_x2, bg_y2)], 
-                                     fill=(bg_rgb[0], bg_rgb[1], bg_rgb[2], text_bg_alpha))
-            
-            draw_text_with_shadow(draw_ov, (text_x, text_y), text_content or "", text_font,
-                                 text_color, text_shadow, scale=scale, text_styles=get_text_style_str(grp, 'text'), align=text_align)
-        else:
-            # 功能项分组处理
-            if sub_text:
-                try:
-                    if hasattr(draw_ov, "textbbox"):
-                        bbox = draw_ov.textbbox((0, 0), title_text, font=gtf)
-                        title_w = bbox[2] - bbox[0]
-                        title_h = bbox[3] - bbox[1]
-                    else:
-                        title_w, title_h = draw_ov.textsize(title_text, font=gtf)
-                except:
-                    title_w, title_h = 100, 30
+                text_content = wrap_text_to_width(text_content, font_of(text_font), max_text_width, measure)
 
+            # 换行后的文字可能超出分组矩形
+            text_bottom = text_y
+            if text_content:
                 try:
-                    if hasattr(draw_ov, "textbbox"):
-                        s_bbox = draw_ov.textbbox((0, 0), sub_text, font=gsf)
-                        sub_h = s_bbox[3] - s_bbox[1]
+                    if hasattr(measure, "multiline_textbbox"):
+                        text_bottom = text_y + measure.multiline_textbbox((0, 0), text_content,
+                                                                          font=font_of(text_font), spacing=4)[3]
                     else:
-                        _, sub_h = draw_ov.textsize(sub_text, font=gsf)
+                        text_bottom = text_y + measure.multiline_textsize(text_content, font=font_of(text_font),
+                                                                          spacing=4)[1]
                 except:
-                    sub_h = 18
-
-                align = get_style(grp, menu_data, 'sub_align', 'group_sub_align', 'bottom')
-
-                sub_x = title_x + title_w + s(15)
-                sub_y = ty
-
-                if align == 'bottom':
-                    sub_y = ty + title_h - sub_h - s(2)
-                elif align == 'center':
-                    sub_y = ty + (title_h - sub_h) / 2
-                
-                # 获取分组副标题的阴影配置和样式
-                group_sub_shadow = get_shadow_config(grp, menu_data, 'group_sub')
-                group_sub_styles = get_text_style_str(grp, 'group_sub')
-                draw_text_with_shadow(draw_ov, (sub_x, sub_y), sub_text, gsf,
-                                      hex_to_rgb(get_style(grp, menu_data, 'sub_color', 'group_sub_color', '#AAAAAA')),
-                                      group_sub_shadow, scale=scale, text_styles=group_sub_styles)
-
-            item_grid_w = (bw - s(40) - (g_info["columns"] - 1) * ITEM_GAP_X) // g_info["columns"]
-            for i, item in enumerate(grp.get("items", [])):
-                if g_info["is_free"]:
-                    ix, iy, iw, ih = bx + s(int(item.get("x", 0))), by + s(int(item.get("y", 0))), s(
-                        int(item.get("w", 100))), s(int(item.get("h", 100)))
+                    pass
+
+            # 背景区域（文本周围留一些边距）
+            bg_padding = s(10)
+            g["text"] = {"pos": [text_x, text_y], "font": text_font, "content": text_content or "",
+                         "bg_box": [max(bx, text_x - bg_padding), max(by, text_y - bg_padding),
+                                    min(bx2, text_x + max_text_width + bg_padding),
+                                    min(by2, text_y + s(100) + bg_padding)]}  # 假设最大高度
+            g["extent"] = [min(ty, by), max(by2 + 1, int(text_bottom) + 1, g["text"]["bg_box"][3] + 1)]
+            groups.append(g)
+            continue
+
+        # 功能项分组
+        title_text = grp.get("title", "")
+        sub_text = grp.get("subtitle", "")
+        if sub_text:
+            gtf, gsf = font_of(title_font), font_of(sub_font)
+            try:
+                if hasattr(measure, "textbbox"):
+                    bbox = measure.textbbox((0, 0), title_text, font=gtf)
+                    title_w = bbox[2] - bbox[0]
+                    title_h = bbox[3] - bbox[1]
                 else:
-                    r, c = i // g_info["columns"], i % g_info["columns"]
-                    ix, iy, iw, ih = bx + s(20) + c * (item_grid_w + ITEM_GAP_X), by + s(20) + r * (
-                            ITEM_H + ITEM_GAP_Y), item_grid_w, ITEM_H
-                
-                # 处理功能项自定义大小
-                item_custom_w = item.get("custom_width") or menu_data.get("item_custom_width")
-                item_custom_h = item.get("custom_height") or menu_data.get("item_custom_height")
-                if item_custom_w and item_custom_h:
-                    iw = s(int(item_custom_w))
-                    ih = s(int(item_custom_h))
-                
-                # 使用功能项自定义模糊半径或全局模糊半径
-                item_blur = get_style(item, menu_data, 'blur_radius', 'item_blur_radius', 0)
-                
-                draw_glass_rect(overlay, (ix, iy, ix + iw, iy + ih),
-                                get_style(item, menu_data, 'bg_color', 'item_bg_color', '#FFFFFF'),
-                                get_style(item, menu_data, 'bg_alpha', 'item_bg_alpha', 20),
-                                item_blur, corner_r=s(10))
-                
-                # 为每个功能项构建字体和颜色配置
-                fmap = {
-                    "name": load_font(get_style(item, menu_data, 'name_font', 'item_name_font', 'title.ttf'),
-                                      s(get_style(item, menu_data, 'name_size', 'item_name_size', 26))),
-                    "desc": load_font(get_style(item, menu_data, 'desc_font', 'item_desc_font', 'text.ttf'),
-                                      s(get_style(item, menu_data, 'desc_size', 'item_desc_size', 16))),
-                    "name_color": hex_to_rgb(get_style(item, menu_data, 'name_color', 'item_name_color', '#FFFFFF')),
-                    "desc_color": hex_to_rgb(get_style(item, menu_data, 'desc_color', 'item_desc_color', '#AAAAAA')),
-                }
-                render_item_content(overlay, draw_ov, item, (ix, iy, ix + iw, iy + ih), fmap, shadow_cfg, menu_data, scale)
+                    title_w, title_h = measure.textsize(title_text, font=gtf)
+            except:
+                title_w, title_h = 100, 30
+
+            try:
+                if hasattr(measure, "textbbox"):
+                    s_bbox = measure.textbbox((0, 0), sub_text, font=gsf)
+                    sub_h = s_bbox[3] - s_bbox[1]
+                else:
+                    _, sub_h = measure.textsize(sub_text, font=gsf)
+            except:
+                sub_h = 18
+
+            align = get_style(grp, menu_data, 'sub_align', 'group_sub_align', 'bottom')
+
+            sub_x = title_x + title_w + s(15)
+            sub_y = ty
+
+            if align == 'bottom':
+                sub_y = ty + title_h - sub_h - s(2)
+            elif align == 'center':
+                sub_y = ty + (title_h - sub_h) / 2
+            g["sub_pos"] = [sub_x, sub_y]
+
+        item_grid_w = (bw - s(40) - (g_info["columns"] - 1) * ITEM_GAP_X) // g_info["columns"]
+        for i, item in enumerate(grp.get("items", [])):
+            if g_info["is_free"]:
+                ix, iy, iw, ih = bx + s(int(item.get("x", 0))), by + s(int(item.get("y", 0))), s(
+                    int(item.get("w", 100))), s(int(item.get("h", 100)))
+            else:
+                r, c = i // g_info["columns"], i % g_info["columns"]
+                ix, iy, iw, ih = bx + s(20) + c * (item_grid_w + ITEM_GAP_X), by + s(20) + r * (
+                        ITEM_H + ITEM_GAP_Y), item_grid_w, ITEM_H
+
+            # 处理功能项自定义大小
+            item_custom_w = item.get("custom_width") or menu_data.get("item_custom_width")
+            item_custom_h = item.get("custom_height") or menu_data.get("item_custom_height")
+            if item_custom_w and item_custom_h:
+                iw = s(int(item_custom_w))
+                ih = s(int(item_custom_h))
+
+            name_font = font_ref(get_style(item, menu_data, 'name_font', 'item_name_font', 'title.ttf'),
+                                 s(get_style(item, menu_data, 'name_size', 'item_name_size', 26)))
+            desc_font = font_ref(get_style(item, menu_data, 'desc_font', 'item_desc_font', 'text.ttf'),
+                                 s(get_style(item, menu_data, 'desc_size', 'item_desc_size', 16)))
+            box = (ix, iy, ix + iw, iy + ih)
+            content = _layout_item_content(item, box, font_of(name_font), font_of(desc_font), measure, scale, deps)
+            g["items"].append(dict(content, box=list(box), name_font=name_font, desc_font=desc_font))
+        # 分组绘制内容的纵向范围（不含阴影/模糊外扩），用于确定分组图块
+        g["extent"] = [min([ty, by] + [it["top"] for it in g["items"]] + ([g["sub_pos"][1]] if g["sub_pos"] else [])),
+                       max([by2 + 1] + [it["bottom"] for it in g["items"]])]
+        groups.append(g)
+
+    return {"size": [final_w, final_h], "scale": scale, "header": header, "groups": groups, "deps": deps}
+
+
+# 分组继承的菜单级样式字段前缀（get_style / get_shadow_config 的回退字段）
+_GROUP_INHERITED_PREFIXES = ("group_", "item_", "shadow_")
+# 分组图块在内容纵向范围外预留的余量（基准像素），容纳阴影偏移、描边与字形出血
+GROUP_TILE_MARGIN = 20
+
+
+class _GroupTile(NamedTuple):
+    image: Optional[Image.Image]  # 裁剪到非空像素的分组图块，分组无内容时为 None
+    left: int
+    top: int
+
+    @property
+    def rect(self) -> Optional[Tuple[int, int, int, int]]:
+        if self.image is None: return None
+        return self.left, self.top, self.left + self.image.width, self.top + self.image.height
+
+
+def _paste_tile(overlay: Image.Image, tile: _GroupTile, painted: list) -> bool:
+    """
+    把分组图块贴到前景层，painted 为已绘制内容的矩形；与已有内容落在同一像素上时返回 False（须直接绘制）
+    分组绘制的每个像素在空白图块上都会变为非零，因此只贴非零像素且不与已有内容重叠时与直接绘制逐像素一致
+    """
+    x1, y1, x2, y2 = tile.rect
+    if not any(x1 < rx2 and rx1 < x2 and y1 < ry2 and ry1 < y2 for rx1, ry1, rx2, ry2 in painted):
+        overlay.paste(tile.image, (x1, y1))
+        return True
+    tile_mask = np.asarray(tile.image).any(axis=2)
+    if (np.asarray(overlay.crop(tile.rect)).any(axis=2) & tile_mask).any(): return False
+    overlay.paste(tile.image, (x1, y1), Image.fromarray(tile_mask.view(np.uint8) * 255, "L"))
+    return True
+
+
+def _shift_group(g: dict, dy: int) -> dict:
+    """分组排版整体上移 dy 像素（换算到图块坐标）"""
+
+    def pos(p):
+        return [p[0], p[1] - dy]
+
+    def box(b):
+        return [b[0], b[1] - dy, b[2], b[3] - dy]
+
+    out = dict(g, box=box(g["box"]), title_pos=pos(g["title_pos"]), extent=[v - dy for v in g["extent"]],
+               sub_pos=pos(g["sub_pos"]) if g["sub_pos"] else None)
+    if g["text"]:
+        out["text"] = dict(g["text"], pos=pos(g["text"]["pos"]), bg_box=box(g["text"]["bg_box"]))
+    out["items"] = [dict(it, box=box(it["box"]), name_pos=pos(it["name_pos"]), desc_pos=pos(it["desc_pos"]),
+                         top=it["top"] - dy, bottom=it["bottom"] - dy,
+                         icon=[it["icon"][0], it["icon"][1], it["icon"][2] - dy] + it["icon"][3:] if it["icon"] else None)
+                    for it in g["items"]]
+    return out
+
+
+def _max_shadow_offset(*objs) -> int:
+    offsets = [2]
+    for obj in objs:
+        for k, v in obj.items():
+            if "shadow_offset" in k:
+                try:
+                    offsets.append(abs(int(v)))
+                except (TypeError, ValueError):
+                    pass
+    return max(offsets)
+
+
+def _group_tile(menu_data: dict, grp: dict, g: dict, layout: dict) -> Optional[_GroupTile]:
+    """
+    把分组绘制到与画布同宽、覆盖其纵向范围（外扩阴影/模糊余量）的透明图块上并裁剪到非空像素，
+    按分组数据、继承的菜单样式与相对图块的排版缓存，分组平移后仍可复用；
+    内容触及图块上下边缘（可能被截断）时返回 None，由调用方直接绘制
+    """
+    canvas_w, canvas_h = layout["size"]
+    scale = layout["scale"]
+    margin = int((GROUP_TILE_MARGIN + _max_shadow_offset(menu_data, grp, *grp.get("items", []))) * scale)
+    if g["text"]:
+        # 纯文本分组的模糊背景向外扩散
+        margin += blur_padding(int(grp.get("text_bg_blur", menu_data.get("group_sub_bg_blur", 5)) or 0))
+    top = max(0, g["extent"][0] - margin)
+    bottom = min(canvas_h, g["extent"][1] + margin)
+    if bottom <= top: return _GroupTile(None, 0, top)
+
+    local = _shift_group(g, top)
+    inherited = {k: v for k, v in menu_data.items() if k.startswith(_GROUP_INHERITED_PREFIXES)}
+    raw = json.dumps([local, grp, inherited, canvas_w, bottom - top, scale, top == 0, bottom == canvas_h,
+                      layout["deps"]], sort_keys=True, ensure_ascii=False, default=str)
+    key = hashlib.sha1(raw.encode("utf-8")).hexdigest()
+
+    cached = tile_cache.get(key)
+    if cached is None:
+        tile = Image.new("RGBA", (canvas_w, bottom - top), (0, 0, 0, 0))
+        _paint_group(tile, ImageDraw.Draw(tile), grp, local, menu_data, scale)
+        bbox = tile.getbbox(alpha_only=False)
+        if bbox and ((bbox[1] == 0 and top > 0) or (bbox[3] == tile.height and bottom < canvas_h)):
+            cached = False
+        elif bbox:
+            cached = (tile.crop(bbox), bbox[0], bbox[1])
+        else:
+            cached = (None, 0, 0)
+        img = cached[0] if cached else None
+        tile_cache.put(key, cached, img.width * img.height * 4 if img is not None else 64)
+    if cached is False: return None
+    img, x, y = cached
+    return _GroupTile(img, x, top + y)
+
+
+def _paint_group(overlay: Image.Image, draw_ov, grp: dict, g: dict, menu_data: dict, scale: float):
+    """按分组排版绘制分组背景、标题、纯文本或功能项"""
+
+    def s(val):
+        return int(val * scale)
+
+    bx, by, bx2, by2 = g["box"]
+    group_blur = int(get_style(grp, menu_data, 'blur_radius', 'group_blur_radius', 0) or 0)
+
+    # 只绘制半透明层，不做模糊
+    draw_glass_rect(overlay, (bx, by, bx2, by2), get_style(grp, menu_data, 'bg_color', 'group_bg_color', '#000000'),
+                    get_style(grp, menu_data, 'bg_alpha', 'group_bg_alpha', 50),
+                    group_blur, corner_r=s(15), apply_blur=False)
+
+    # 获取分组标题的阴影配置和样式
+    group_title_shadow = get_shadow_config(grp, menu_data, 'group_title')
+    group_title_styles = get_text_style_str(grp, 'group_title')
+
+    draw_text_with_shadow(draw_ov, tuple(g["title_pos"]), grp.get("title", ""), load_font(*g["title_font"]),
+                          hex_to_rgb(get_style(grp, menu_data, 'title_color', 'group_title_color', '#FFFFFF')),
+                          group_title_shadow, scale=scale, text_styles=group_title_styles)
+
+    text = g["text"]
+    if text:
+        # 纯文本分组处理
+        text_color = hex_to_rgb(grp.get("text_color") or menu_data.get("group_sub_color", '#AAAAAA'))
+        text_shadow = get_shadow_config(grp, menu_data, 'group_sub')
+
+        # 获取纯文本的背景毛玻璃效果配置
+        text_bg_color = grp.get("text_bg_color") or menu_data.get("group_sub_bg_color", "#333333")
+        text_bg_alpha = int(grp.get("text_bg_alpha", menu_data.get("group_sub_bg_alpha", 200)))
+        text_bg_blur = int(grp.get("text_bg_blur", menu_data.get("group_sub_bg_blur", 5)))
+
+        # 如果启用背景毛玻璃效果，先绘制背景
+        if text_bg_alpha > 0 and text_bg_blur >= 0:
+            bg_x1, bg_y1, bg_x2, bg_y2 = text["bg_box"]
+
+            # 绘制背景矩形 (毛玻璃效果)
+            bg_rgb = hex_to_rgb(text_bg_color)
+            if text_bg_blur > 0:
+                # 模糊背景 (半透明填充后模糊模拟毛玻璃)，只在矩形外扩模糊范围的区域内计算
+                blurred = blurred_rect(overlay.size, (bg_x1, bg_y1, bg_x2, bg_y2),
+                                       (bg_rgb[0], bg_rgb[1], bg_rgb[2], text_bg_alpha), text_bg_blur)
+                if blurred:
+                    overlay.paste(blurred[0], blurred[1], blurred[0])
+            else:
+                # 不模糊，直接填充
+                draw_ov.rectangle([(bg_x1, bg_y1), (bg_x2, bg_y2)],
+                                 fill=(bg_rgb[0], bg_rgb[1], bg_rgb[2], text_bg_alpha))
+
+        draw_text_with_shadow(draw_ov, tuple(text["pos"]), text["content"], load_font(*text["font"]),
+                             text_color, text_shadow, scale=scale, text_styles=get_text_style_str(grp, 'text'),
+                             align=grp.get("text_align", "left"))
+        return
+
+    # 功能项分组处理
+    if g["sub_pos"]:
+        # 获取分组副标题的阴影配置和样式
+        group_sub_shadow = get_shadow_config(grp, menu_data, 'group_sub')
+        group_sub_styles = get_text_style_str(grp, 'group_sub')
+        draw_text_with_shadow(draw_ov, tuple(g["sub_pos"]), grp.get("subtitle", ""), load_font(*g["sub_font"]),
+                              hex_to_rgb(get_style(grp, menu_data, 'sub_color', 'group_sub_color', '#AAAAAA')),
+                              group_sub_shadow, scale=scale, text_styles=group_sub_styles)
+
+    for item, it in zip(grp.get("items", []), g["items"]):
+        # 使用功能项自定义模糊半径或全局模糊半径
+        item_blur = get_style(item, menu_data, 'blur_radius', 'item_blur_radius', 0)
+
+        draw_glass_rect(overlay, tuple(it["box"]),
+                        get_style(item, menu_data, 'bg_color', 'item_bg_color', '#FFFFFF'),
+                        get_style(item, menu_data, 'bg_alpha', 'item_bg_alpha', 20),
+                        item_blur, corner_r=s(10))
+
+        # 为每个功能项构建字体和颜色配置
+        fmap = {
+            "name": load_font(*it["name_font"]),
+            "desc": load_font(*it["desc_font"]),
+            "name_color": hex_to_rgb(get_style(item, menu_data, 'name_color', 'item_name_color', '#FFFFFF')),
+            "desc_color": hex_to_rgb(get_style(item, menu_data, 'desc_color', 'item_desc_color', '#AAAAAA')),
+        }
+        render_item_content(overlay, draw_ov, item, it, fmap, menu_data, scale)
+
+
+def paint_layout(menu_data: dict, layout: dict) -> Tuple[Image.Image, list]:
+    """绘制阶段：按排版树与颜色/透明度/阴影等绘制字段绘制前景层，返回 (前景, 磨砂区域)"""
+    scale = layout["scale"]
+
+    def s(val):
+        return int(val * scale)
+
+    shadow_cfg = {
+        'enabled': menu_data.get('shadow_enabled', False),
+        'color': menu_data.get('shadow_color', '#000000'),
+        'offset_x': menu_data.get('shadow_offset_x', 2),
+        'offset_y': menu_data.get('shadow_offset_y', 2),
+        'radius': menu_data.get('shadow_radius', 2)
+    }
+    blur_regions = []  # 收集所有需要磨砂的区域
+
+    overlay = Image.new("RGBA", tuple(layout["size"]), (0, 0, 0, 0))
+    draw_ov = ImageDraw.Draw(overlay)
+
+    header = layout["header"]
+    tx, anc = header["x"], header["anchor"]
+    # 获取主标题的阴影配置和样式
+    title_shadow = get_shadow_config(menu_data, menu_data, 'title')
+    title_styles = get_text_style_str(menu_data, 'title')
+    draw_text_with_shadow(draw_ov, (tx, header["y"]), menu_data.get("title", ""), load_font(*header["font"]),
+                          hex_to_rgb(menu_data.get("title_color") or "#FFFFFF"), title_shadow, anchor=anc, scale=scale, text_styles=title_styles)
+
+    # 获取副标题的阴影配置和样式
+    subtitle_shadow = get_shadow_config(menu_data, menu_data, 'subtitle')
+    subtitle_styles = get_text_style_str(menu_data, 'subtitle')
+    draw_text_with_shadow(draw_ov, (tx, header["sub_y"]), menu_data.get("sub_title", ""), load_font(*header["sub_font"]),
+                          hex_to_rgb(menu_data.get("subtitle_color") or "#FFFFFF"), subtitle_shadow, anchor=anc, scale=scale, text_styles=subtitle_styles)
+
+    # 已绘制内容的矩形：分组图块只有不与它们重叠时，直接贴上才与直接绘制一致
+    header_bbox = overlay.getbbox(alpha_only=False)
+    painted = [header_bbox] if header_bbox else []
+    for grp, g in zip(menu_data.get("groups", []), layout["groups"]):
+        bx, by, bx2, by2 = g["box"]
+
+        # 使用分组自定义模糊半径或全局模糊半径
+        group_blur = int(get_style(grp, menu_data, 'blur_radius', 'group_blur_radius', 0) or 0)
+
+        # 收集磨砂区域信息，稍后在有背景时处理
+        if group_blur > 0:
+            blur_regions.append({
+                'box': (bx, by, bx2, by2),
+                'radius': group_blur,
+                'corner_r': s(15)
+            })
+
+        tile = _group_tile(menu_data, grp, g, layout)
+        rect = tile.rect if tile is not None else (0, 0, overlay.width, overlay.height)
+        if rect is None: continue
+        if tile is None or not _paste_tile(overlay, tile, painted):
+            # 与已绘制内容重叠或图块容纳不下时直接绘制到前景层
+            _paint_group(overlay, draw_ov, grp, g, menu_data, scale)
+        painted.append(rect)
+
     for w in menu_data.get("custom_widgets", []):
         try:
             wx, wy = s(int(w.get("x", 0))), s(int(w.get("y", 0)))
             if w.get("type") == 'image':
                 if (c := w.get("content")) and plugin_storage.img_dir:
-                    with Image.open(plugin_storage.img_dir / c).convert("RGBA") as wi:
-                        wi = wi.resize((s(int(w.get("width", 100))), s(int(w.get("height", 100)))),
-                                       Image.Resampling.LANCZOS)
-                        overlay.paste(wi, (wx, wy), wi)
+                    wi = load_image(plugin_storage.img_dir / c,
+                                    (s(int(w.get("width", 100))), s(int(w.get("height", 100)))))
+                    overlay.paste(wi, (wx, wy), wi)
             else:
                 f = load_font(w.get("font", ""), s(int(w.get("size", 40))))
                 draw_text_with_shadow(draw_ov, (wx, wy), w.get("text", "Text"), f, hex_to_rgb(w.get("color", "#FFF")),
@@ -675,11 +944,15 @@ def _render_layout(menu_data: dict, is_video_mode: bool) -> Image.Image:
     return overlay, blur_regions
 
 
-def render_static(menu_data: dict) -> Image.Image:
-    import random
-    layout_img, blur_regions = _render_layout(menu_data, is_video_mode=False)
-    fw, fh = layout_img.size
+def _render_layout(menu_data: dict, is_video_mode: bool) -> Tuple[Image.Image, list]:
+    return paint_layout(menu_data, compute_layout(menu_data, is_video_mode))
+
 
+def _background_layer(menu_data: dict, bg_name: Optional[str], fw: int, fh: int) -> Tuple[Image.Image, Optional[tuple]]:
+    """
+    底色 + 缩放定位后的背景图，按 (背景文件, mtime, 画布尺寸, 底色, 适配/对齐/缩放参数) 缓存
+    返回 (图层, 缓存键)，图层在多次渲染间共享，只能复制或裁剪；背景读取失败时不缓存，缓存键为 None
+    """
     scale = float(menu_data.get("export_scale", 1.0))
     if scale <= 0: scale = 1.0
 
@@ -687,7 +960,58 @@ def render_static(menu_data: dict) -> Image.Image:
         return int(val * scale)
 
     c_color = hex_to_rgb(menu_data.get("canvas_color", "#1e1e1e"))
-    final_img = Image.new("RGBA", (fw, fh), c_color + (255,))
+    bg_path = plugin_storage.bg_dir / bg_name if bg_name and plugin_storage.bg_dir else None
+    fit_mode = menu_data.get("bg_fit_mode", "cover")
+    align_x = menu_data.get("bg_align_x", "center")
+    align_y = menu_data.get("bg_align_y", "center")
+    bg_scale = float(menu_data.get("video_scale", 1.0))
+    custom_w = s(int(menu_data.get("bg_custom_width", 1000)))
+    custom_h = s(int(menu_data.get("bg_custom_height", 1000)))
+    key = ("bg_layer", str(bg_path) if bg_path else None, _file_mtime(bg_path) if bg_path else None, fw, fh,
+           c_color, fit_mode, align_x, align_y, bg_scale, custom_w, custom_h)
+    layer = background_cache.get(key)
+    if layer is not None: return layer, key
+
+    layer = Image.new("RGBA", (fw, fh), c_color + (255,))
+    if bg_path:
+        try:
+            bg_w, bg_h = get_image_size(bg_path)
+            new_w, new_h, px, py = _calculate_bg_layout(
+                bg_w, bg_h, fw, fh,
+                fit_mode, bg_scale, align_x, align_y,
+                custom_w, custom_h
+            )
+            bg_rz = load_image(bg_path, (new_w, new_h))
+            layer.paste(bg_rz, (px, py), bg_rz)
+        except Exception as e:
+            logger.error(f"Static BG Error: {e}")
+            return layer, None
+    background_cache.put(key, layer, fw * fh * 4)
+    return layer, key
+
+
+def render_shared_foreground(menu_data: dict) -> Tuple[Image.Image, list, dict]:
+    """
+    随机背景各版本共享的前景：背景只影响画布高度（按背景比例拉高），内容均从顶部排起，
+    因此按最高的版本绘制一次，各版本裁剪到自己的高度即可；返回 (前景, 磨砂区域, {背景名: 画布尺寸})
+    """
+    sizes, tallest = {}, None
+    for bg_name in menu_data.get("backgrounds", []) or [menu_data.get("background")]:
+        layout = compute_layout(dict(menu_data, background=bg_name, backgrounds=[]), False)
+        sizes[bg_name] = tuple(layout["size"])
+        if tallest is None or layout["size"][1] > tallest["size"][1]: tallest = layout
+    overlay, blur_regions = paint_layout(menu_data, tallest)
+    return overlay, blur_regions, sizes
+
+
+def render_static(menu_data: dict, foreground: Optional[Tuple[Image.Image, list]] = None,
+                  size: Optional[Tuple[int, int]] = None) -> Image.Image:
+    """静态菜单；foreground 为 render_shared_foreground 预先绘制的共享前景，size 为本版本的画布尺寸"""
+    import random
+    layout_img, blur_regions = foreground or _render_layout(menu_data, is_video_mode=False)
+    if size and tuple(size) != layout_img.size:
+        layout_img = layout_img.crop((0, 0) + tuple(size))
+    fw, fh = layout_img.size
 
     # 随机背景支持：优先使用 backgrounds 列表，否则使用单个 background
     bg_name = None
@@ -697,27 +1021,11 @@ def render_static(menu_data: dict) -> Image.Image:
     else:
         bg_name = menu_data.get("background")
 
-    if bg_name and plugin_storage.bg_dir:
-        try:
-            with Image.open(plugin_storage.bg_dir / bg_name).convert("RGBA") as bg_img:
-                fit_mode = menu_data.get("bg_fit_mode", "cover")
-                align_x = menu_data.get("bg_align_x", "center")
-                align_y = menu_data.get("bg_align_y", "center")
-                bg_scale = float(menu_data.get("video_scale", 1.0))
-                custom_w = s(int(menu_data.get("bg_custom_width", 1000)))
-                custom_h = s(int(menu_data.get("bg_custom_height", 1000)))
-
-                new_w, new_h, px, py = _calculate_bg_layout(
-                    bg_img.width, bg_img.height, fw, fh,
-                    fit_mode, bg_scale, align_x, align_y,
-                    custom_w, custom_h
-                )
-                bg_rz = bg_img.resize((new_w, new_h), Image.Resampling.LANCZOS)
-                final_img.paste(bg_rz, (px, py), bg_rz)
-        except Exception as e:
-            logger.error(f"Static BG Error: {e}")
+    layer, layer_key = _background_layer(menu_data, bg_name, fw, fh)
+    final_img = layer.copy()
 
-    # 新增：在背景上应用磨砂效果
+    # 在背景上应用磨砂效果：与之前的磨砂区域不相交的区域只取决于背景图层，按 (图层, 区域, 半径) 缓存模糊结果
+    done = []
     for region in blur_regions:
         x1, y1, x2, y2 = [int(v) for v in region['box']]
         radius = region['radius']
@@ -727,153 +1035,273 @@ def render_static(menu_data: dict) -> Image.Image:
         x2 = max(0, min(x2, fw))
         y2 = max(0, min(y2, fh))
         if radius > 0 and x2 > x1 and y2 > y1:
-            cropped = final_img.crop((x1, y1, x2, y2))
-            blurred = cropped.filter(ImageFilter.GaussianBlur(radius=radius))
-            final_img.paste(blurred, (x1, y1))
+            independent = layer_key is not None and not any(
+                x1 < bx2 and bx1 < x2 and y1 < by2 and by1 < y2 for bx1, by1, bx2, by2 in done)
+            blurred = background_cache.get((layer_key, (x1, y1, x2, y2), radius)) if independent else None
+            if blurred is None:
+                blurred = blur_box(final_img, (x1, y1, x2, y2), radius)
+                if independent:
+                    background_cache.put((layer_key, (x1, y1, x2, y2), radius), blurred, (x2 - x1) * (y2 - y1) * 4)
+            final_img.paste(*blurred)
+            done.append((x1, y1, x2, y2))
     final_img.alpha_composite(layout_img)
     return final_img
 
 
-def render_animated(menu_data: dict, output_path: Path) -> Optional[Path]:
-    writer = None
-    reader = None
-    write_path = output_path
+def _video_range(menu_data: dict, meta: dict) -> Tuple[float, float, float]:
+    """返回 (源帧率, 开始时间, 结束时间)，结束时间不超过视频时长"""
+    src_fps = meta.get('fps') or 30
+    duration = meta.get('duration', 0)
+    start_t = float(menu_data.get("video_start", 0))
+    end_t = float(menu_data.get("video_end", 0))
+    end_limit = duration
+    if end_t > start_t: end_limit = min(duration, end_t)
+    return src_fps, min(start_t, duration), end_limit
 
-    try:
-        foreground, _ = _render_layout(menu_data, is_video_mode=True)
-        cw, ch = foreground.size
 
-        video_name = menu_data.get("bg_video")
-        if not video_name or not plugin_storage.video_dir: return None
-        video_path = plugin_storage.video_dir / video_name
-        if not video_path.exists(): return None
+def _video_layout(menu_data: dict, cw: int, ch: int, src_w: int, src_h: int) -> Tuple[int, int, int, int]:
+    """视频在画布上的显示尺寸与位置 (宽, 高, x, y)"""
+    bg_scale_factor = float(menu_data.get("video_scale", 1.0))
+    fit_mode = menu_data.get("bg_fit_mode", "cover")
+    align_x = menu_data.get("video_align_x") or menu_data.get("bg_align_x", "center")
+    align_y = menu_data.get("video_align") or menu_data.get("video_align_y") or menu_data.get("bg_align_y",
+                                                                                              "center")
 
-        start_t = float(menu_data.get("video_start", 0))
-        end_t = float(menu_data.get("video_end", 0))
-        target_fps = int(menu_data.get("video_fps", 15))
-        frame_ratio = max(1, int(menu_data.get("video_frame_ratio", 1)))
-
-        bg_scale_factor = float(menu_data.get("video_scale", 1.0))
-        fps_mode = menu_data.get("video_fps_mode", "fixed")
-
-        reader = imageio.get_reader(str(video_path))
-        meta = reader.get_meta_data()
-        src_fps = meta.get('fps', 30)
-        duration = meta.get('duration', 0)
-
-        end_limit = duration
-        if end_t > start_t: end_limit = min(duration, end_t)
-        start_t = min(start_t, duration)
-
-        step = max(1, int(round(src_fps / target_fps))) if fps_mode == "fixed" else frame_ratio
-
-        fmt = menu_data.get("video_export_format", "apng").lower()
-        writer_kwargs = {}
-        format_str = None
-
-        if fmt == "apng":
-            format_str = 'FFMPEG'
-            write_path = output_path.parent / f"temp_{output_path.stem}.mp4"
-            writer_kwargs = {
-                'fps': target_fps, 'codec': 'apng', 'pixelformat': 'rgba',
-                'output_params': ['-f', 'apng', '-pred', 'mixed', '-plays', '0']
-            }
-            if write_path.exists():
-                try:
-                    write_path.unlink()
-                except:
-                    pass
-        elif fmt == "webp":
-            format_str = 'WEBP'
-            writer_kwargs = {'fps': target_fps, 'quality': 60, 'loop': 0, 'method': 6, 'lossless': False}
-        elif fmt == "gif":
-            format_str = 'GIF'
-            writer_kwargs = {'fps': target_fps, 'loop': 0, 'quantizer': 'nq', 'palettesize': 128}
-        else:
-            writer_kwargs = {'fps': target_fps}
+    scale_global = float(menu_data.get("export_scale", 1.0))
 
-        fit_mode = menu_data.get("bg_fit_mode", "cover")
-        align_x = menu_data.get("video_align_x") or menu_data.get("bg_align_x", "center")
-        align_y = menu_data.get("video_align") or menu_data.get("video_align_y") or menu_data.get("bg_align_y",
-                                                                                                  "center")
+    def s_loc(val):
+        return int(val * scale_global)
 
-        scale_global = float(menu_data.get("export_scale", 1.0))
+    custom_w = s_loc(int(menu_data.get("bg_custom_width", 1000)))
+    custom_h = s_loc(int(menu_data.get("bg_custom_height", 1000)))
 
-        def s_loc(val):
-            return int(val * scale_global)
+    return _calculate_bg_layout(src_w, src_h, cw, ch, fit_mode, bg_scale_factor, align_x, align_y, custom_w, custom_h)
 
-        custom_w = s_loc(int(menu_data.get("bg_custom_width", 1000)))
-        custom_h = s_loc(int(menu_data.get("bg_custom_height", 1000)))
 
-        canvas_bg_color = hex_to_rgb(menu_data.get("canvas_color", "#1e1e1e"))
-        base_bg = np.zeros((ch, cw, 4), dtype=np.uint8)
-        base_bg[:, :, 0] = canvas_bg_color[0]
-        base_bg[:, :, 1] = canvas_bg_color[1]
-        base_bg[:, :, 2] = canvas_bg_color[2]
-        base_bg[:, :, 3] = 255
+def _video_compositor(menu_data: dict, foreground: Image.Image, meta: dict) -> VideoCompositor:
+    """按视频适配/对齐/缩放参数创建逐帧合成器；读取代理时按原视频尺寸排版，只从代理帧取样"""
+    cw, ch = foreground.size
+    layout_size = meta.get("origin_size")
+    canvas_bg_color = hex_to_rgb(menu_data.get("canvas_color", "#1e1e1e"))
+    return VideoCompositor(
+        foreground, canvas_bg_color,
+        lambda fw, fh: _video_layout(menu_data, cw, ch, *(layout_size or (fw, fh))))
 
-        writer = imageio.get_writer(str(write_path), format=format_str, **writer_kwargs)
-        frame_count, max_frames = 0, 300
 
-        for i, frame in enumerate(reader):
-            curr_time = i / src_fps
-            if curr_time < start_t: continue
-            if curr_time > end_limit: break
-            if i % step != 0: continue
+def _video_source(menu_data: dict, video_path: Path, meta: dict, canvas_size: Tuple[int, int]) -> Tuple[Path, dict]:
+    """
+    解码用的视频源与其元数据：上传时生成的代理在分辨率不低于显示尺寸（或原视频本身）、
+    帧率满足菜单设置时读取代理，否则读取原视频
+    """
+    proxy_path, meta_path = plugin_storage.get_video_proxy_paths(video_path.name)
+    proxy = load_video_proxy(video_path, proxy_path, meta_path)
+    if not proxy: return video_path, meta
+
+    src_w, src_h = meta['size']
+    new_w, new_h, _, _ = _video_layout(menu_data, *canvas_size, src_w, src_h)
+    proxy_w, proxy_h = proxy['size']
+    if proxy_w < min(new_w, src_w) or proxy_h < min(new_h, src_h): return video_path, meta
+    if menu_data.get("video_fps_mode", "fixed") == "fixed":
+        if int(menu_data.get("video_fps", 15)) > proxy['fps']: return video_path, meta
+    elif proxy['fps'] < (meta.get('fps') or 30):
+        # 按源帧间隔抽帧时代理必须保留原帧率
+        return video_path, meta
+    return proxy_path, proxy
+
+
+def _video_step(menu_data: dict, meta: dict) -> int:
+    """源视频抽帧步长"""
+    src_fps = meta.get('fps') or 30
+    if menu_data.get("video_fps_mode", "fixed") == "fixed":
+        return max(1, int(round(src_fps / int(menu_data.get("video_fps", 15)))))
+    return max(1, int(menu_data.get("video_frame_ratio", 1)))
+
+
+def _encode_animation(menu_data: dict, foreground: Image.Image, video_path: Path, meta: dict, write_path: Path,
+                      step: int, fps: float, max_frames: int, quality: Optional[int] = None) -> dict:
+    """按给定抽帧步长、输出帧率、帧数上限与质量合成并编码一次，返回统计信息（含输出字节数）"""
+    cw, ch = foreground.size
+    src_fps, start_t, end_limit = _video_range(menu_data, meta)
+    src_w, src_h = meta['size']
+    first, count = select_frame_range(src_fps, start_t, end_limit, step, max_frames)
+
+    # 布局只取决于视频尺寸，解码前即可确定；ffmpeg 只输出会被取样的源区域
+    compositor = _video_compositor(menu_data, foreground, meta)
+    window = compositor.plan(src_w, src_h)
+
+    fmt = menu_data.get("video_export_format", "apng").lower()
+    # 视频不在画布内或完全被不透明前景遮挡时各帧相同
+    writer = create_encoder(write_path, fmt, fps, (cw, ch), menu_data.get("video_encoder", "auto"), quality,
+                            compositor.dirty_rect or (0, 0, 0, 0))
+    try:
+        if window:
+            stats = composite_stream(read_video_frames(video_path, src_fps, first, count, step, window),
+                                     compositor, writer.append, workers=VIDEO_COMPOSITE_WORKERS)
+        else:
+            for _ in range(count):
+                writer.append(compositor.static_frame)
+            stats = {"frames": count}
+        t = time.perf_counter()
+        writer.close()
+    except BaseException:
+        writer.abort()
+        raise
+    stats.update(encoder=type(writer).__name__, close_seconds=round(time.perf_counter() - t, 3),
+                 size=(cw, ch), fps=round(fps, 2), bytes=write_path.stat().st_size)
+    return stats
 
-            fh_orig, fw_orig = frame.shape[:2]
 
-            new_w, new_h, px, py = _calculate_bg_layout(
-                fw_orig, fh_orig, cw, ch,
-                fit_mode, bg_scale_factor, align_x, align_y,
-                custom_w, custom_h
-            )
+def _fit_byte_budget(menu_data: dict, foreground: Image.Image, video_path: Path, meta: dict, probe_path: Path,
+                     step: int, fps: float, byte_budget: int) -> Tuple[dict, Image.Image, int, float, int, Optional[int]]:
+    """
+    用少量帧探测编码估算完整输出体积，超出预算时依次降低帧率（保持播放时长）、缩小尺寸、
+    降低 WebP 质量，调整后重新探测，最后按估算截短帧数，使输出一次落在预算内
+    返回 (菜单数据, 前景, 抽帧步长, 输出帧率, 帧数上限, 质量)
+    """
+    src_fps, start_t, end_limit = _video_range(menu_data, meta)
+    fmt = menu_data.get("video_export_format", "apng").lower()
+    base_scale = float(menu_data.get("export_scale", 1.0))
+    # 帧率不低于 BUDGET_MIN_FPS 时允许的最大抽帧步长
+    max_step = max(step, int(step * fps // BUDGET_MIN_FPS))
+    base_step, base_fps = step, fps
+    cur_menu, cur_fg, scale, quality = menu_data, foreground, 1.0, None
+
+    def estimate() -> Tuple[float, int]:
+        """首帧为完整帧，之后各帧多为增量（WebP 还会周期性插入关键帧）：
+        在选取范围内均匀取几段连续帧分别编码，按平均增量帧体积外推"""
+        _, count = select_frame_range(src_fps, start_t, end_limit, step, VIDEO_MAX_FRAMES)
+        if count <= 1: return 0.0, count
+        probe_n = min(count, BUDGET_PROBE_FRAMES)
+        runs = BUDGET_PROBE_RUNS if count >= BUDGET_PROBE_RUNS * probe_n else 1
+        span = max(0.0, end_limit - start_t - probe_n * step / src_fps)
+
+        def probe(t: float, n: int) -> int:
+            return _encode_animation(dict(cur_menu, video_start=t), cur_fg, video_path, meta, probe_path, step,
+                                     base_fps * base_step / step, n, quality)["bytes"]
 
-            img_pil = Image.fromarray(frame).resize((new_w, new_h), Image.Resampling.NEAREST)
-            frame_resized = np.array(img_pil)
+        try:
+            first_bytes = probe(start_t, 1)
+            run_bytes = [probe(start_t + span * i / max(1, runs - 1), probe_n) for i in range(runs)]
+        finally:
+            if probe_path.exists(): probe_path.unlink()
+        per_frame = max(0.0, (sum(run_bytes) / runs - first_bytes) / (probe_n - 1))
+        return first_bytes + per_frame * (count - 1), count
+
+    first_estimate = None
+    for round_no in range(BUDGET_PROBE_ROUNDS):
+        est, count = estimate()
+        if first_estimate is None: first_estimate = est
+        ratio = byte_budget * BUDGET_SAFETY / est if est > 0 else 1.0
+        if ratio >= 1 or round_no == BUDGET_PROBE_ROUNDS - 1: break
+
+        # 1. 降低帧率：增大抽帧步长，输出帧率同比降低，播放时长不变
+        new_step = min(max_step, int(math.ceil(step / ratio)))
+        ratio *= new_step / step
+        # 2. 缩小尺寸（体积近似与像素数成正比）
+        new_scale = scale
+        if ratio < 1:
+            new_scale = max(BUDGET_MIN_SCALE, scale * math.sqrt(ratio))
+            ratio *= (scale / new_scale) ** 2
+        # 3. 降低 WebP 质量
+        new_quality = quality
+        if ratio < 1 and fmt == "webp":
+            cur_q = quality or WEBP_QUALITY
+            new_quality = max(BUDGET_MIN_WEBP_QUALITY, int(cur_q * ratio))
+            ratio *= cur_q / new_quality
+
+        if (new_step, new_scale, new_quality) == (step, scale, quality): break
+        if new_scale != scale:
+            cur_menu = dict(menu_data, export_scale=base_scale * new_scale)
+            cur_fg, _ = _render_layout(cur_menu, is_video_mode=True)
+        step, scale, quality = new_step, new_scale, new_quality
+
+    if first_estimate is not None and first_estimate <= byte_budget * BUDGET_SAFETY:
+        return menu_data, foreground, base_step, base_fps, VIDEO_MAX_FRAMES, None
+
+    # 4. 仍超出预算时截短帧数
+    max_frames = VIDEO_MAX_FRAMES if ratio >= 1 else max(1, int(count * ratio))
+    fps = base_fps * base_step / step
+    logger.info(f"[视频导出] 预计 {first_estimate / 1048576:.1f}MB 超出预算 {byte_budget / 1048576:.1f}MB，"
+                f"调整为 {fps:.1f}fps / 缩放 {scale:.2f} / 质量 {quality or '默认'} / 最多 {max_frames} 帧"
+                f"（预计 {est * min(1.0, ratio) / 1048576:.1f}MB）")
+    return cur_menu, cur_fg, step, fps, max_frames, quality
+
+
+def render_poster(menu_data: dict) -> Optional[Image.Image]:
+    """
+    动态菜单的静态封面：只解码动画的第一帧（一次跳转），与前景合成，结果与动画首帧一致；
+    视频不存在或读取失败时返回 None
+    """
+    try:
+        video_name = menu_data.get("bg_video")
+        if not video_name or not plugin_storage.video_dir: return None
+        video_path = plugin_storage.video_dir / video_name
+        if not video_path.exists(): return None
 
-            current_canvas_bg = base_bg.copy()
+        foreground, _ = _render_layout(menu_data, is_video_mode=True)
+        video_path, meta = _video_source(menu_data, video_path, probe_video(video_path), foreground.size)
+        src_fps, start_t, end_limit = _video_range(menu_data, meta)
+        first, count = select_frame_range(src_fps, start_t, end_limit, _video_step(menu_data, meta), 1)
+
+        compositor = _video_compositor(menu_data, foreground, meta)
+        window = compositor.plan(*meta['size'])
+        frame = compositor.static_frame
+        if window and count:
+            frame = next(iter(read_video_frames(video_path, src_fps, first, 1, 1, window)), None)
+            if frame is None: return None
+            frame = compositor.composite(frame)
+        return Image.fromarray(frame)
+    except Exception:
+        logger.error(f"Render Poster Error: {traceback.format_exc()}")
+        return None
 
-            y1, y2 = max(0, py), min(ch, py + new_h)
-            x1, x2 = max(0, px), min(cw, px + new_w)
 
-            sy1, sy2 = max(0, -py), min(new_h, new_h - (py + new_h - ch))
-            sx1, sx2 = max(0, -px), min(new_w, new_w - (px + new_w - cw))
+def render_animated(menu_data: dict, output_path: Path, byte_budget: Optional[int] = None) -> Optional[Path]:
+    """
+    渲染动态菜单；给定 byte_budget 时先估算体积并自适应调整帧率/尺寸/质量/帧数，
+    估算偏差导致仍超出预算时再按实际体积截短重编码一次
+    """
+    # 先写入临时文件，完成后原子替换，避免并发读取到写了一半的输出
+    tmp_id = uuid.uuid4().hex[:8]
+    write_path = output_path.with_name(f"tmp_{tmp_id}_{output_path.name}")
+    probe_path = output_path.with_name(f"tmp_{tmp_id}_probe_{output_path.name}")
 
-            if y2 > y1 and x2 > x1:
-                if frame_resized.shape[2] == 3:
-                    current_canvas_bg[y1:y2, x1:x2, :3] = frame_resized[sy1:sy2, sx1:sx2, :]
-                else:
-                    current_canvas_bg[y1:y2, x1:x2, :] = frame_resized[sy1:sy2, sx1:sx2, :]
+    try:
+        video_name = menu_data.get("bg_video")
+        if not video_name or not plugin_storage.video_dir: return None
+        video_path = plugin_storage.video_dir / video_name
+        if not video_path.exists(): return None
+
+        foreground, _ = _render_layout(menu_data, is_video_mode=True)
 
-            bg_with_video_pil = Image.fromarray(current_canvas_bg, mode="RGBA")
-            bg_with_video_pil.alpha_composite(foreground)
+        target_fps = int(menu_data.get("video_fps", 15))
 
-            writer.append_data(np.array(bg_with_video_pil))
-            frame_count += 1
-            if frame_count >= max_frames: break
+        video_path, meta = _video_source(menu_data, video_path, probe_video(video_path), foreground.size)
+        step = _video_step(menu_data, meta)
 
-        writer.close()
-        writer = None
+        fps, max_frames, quality = target_fps, VIDEO_MAX_FRAMES, None
+        if byte_budget:
+            menu_data, foreground, step, fps, max_frames, quality = _fit_byte_budget(
+                menu_data, foreground, video_path, meta, probe_path, step, fps, byte_budget)
 
-        if write_path != output_path:
-            if output_path.exists():
-                output_path.unlink()
-            write_path.rename(output_path)
+        stats = _encode_animation(menu_data, foreground, video_path, meta, write_path, step, fps, max_frames, quality)
+        if byte_budget and stats["bytes"] > byte_budget and stats["frames"] > 1:
+            max_frames = max(1, int(stats["frames"] * byte_budget * BUDGET_SAFETY / stats["bytes"]))
+            logger.info(f"[视频导出] 实际 {stats['bytes'] / 1048576:.1f}MB 超出预算，截短为 {max_frames} 帧重新编码")
+            stats = _encode_animation(menu_data, foreground, video_path, meta, write_path, step, fps, max_frames,
+                                      quality)
+        logger.info(f"[视频导出] {output_path.name}: {stats}")
 
+        os.replace(write_path, output_path)
         return output_path
 
     except Exception as e:
         logger.error(f"Render Stream Error: {traceback.format_exc()}")
         return None
     finally:
-        if writer is not None:
-            try:
-                writer.close()
-            except:
-                pass
-        if reader is not None:
-            try:
-                reader.close()
-            except:
-                pass
\ No newline at end of file
+        for path in (write_path, probe_path):
+            if path.exists():
+                try:
+                    path.unlink()
+                except:
+                    pass
@@ -0,0 +1,104 @@
+import bisect
+import itertools
+import threading
+import weakref
+from typing import Dict, List
+
+# 每个字体对象的单字符前进宽度缓存 {font: {char: advance}}，字体对象释放后自动清除
+_advance_cache: "weakref.WeakKeyDictionary" = weakref.WeakKeyDictionary()
+_advance_lock = threading.Lock()
+
+
+def text_width(draw, text: str, font) -> float:
+    """文本实际右边界（含字距调整与末字形出血），与直接调用 textbbox 的结果一致"""
+    try:
+        if hasattr(draw, 'textbbox'):
+            return draw.textbbox((0, 0), text, font=font)[2]
+        return draw.textsize(text, font=font)[0]
+    except:
+        return len(text) * 20
+
+
+def char_advances(font, text: str) -> List[float]:
+    """逐字符前进宽度，按 (字体, 字符) 缓存"""
+    with _advance_lock:
+        table: Dict[str, float] = _advance_cache.get(font)
+        if table is None:
+            table = {}
+            _advance_cache[font] = table
+    advances = []
+    for ch in text:
+        adv = table.get(ch)
+        if adv is None:
+            adv = font.getlength(ch)
+            table[ch] = adv
+        advances.append(adv)
+    return advances
+
+
+def _wrap_line_by_prefix(line: str, font, max_width: int, draw) -> List[str]:
+    """逐字符累加测量的原始换行算法，字体不支持 getlength 时使用"""
+    wrapped, current_line = [], ''
+    for char in line:
+        test_line = current_line + char
+        if text_width(draw, test_line, font) <= max_width:
+            current_line = test_line
+        else:
+            if current_line:
+                wrapped.append(current_line)
+            current_line = char
+    if current_line:
+        wrapped.append(current_line)
+    return wrapped
+
+
+def _wrap_line(line: str, font, max_width: int, draw) -> List[str]:
+    """
+    用累计前进宽度二分估计断点，再用 textbbox 在断点处校正（字距/字形出血），
+    每行只需少量精确测量，结果与逐字符累加测量一致
+    """
+    try:
+        advances = char_advances(font, line)
+    except Exception:
+        return _wrap_line_by_prefix(line, font, max_width, draw)
+    cum = [0.0] + list(itertools.accumulate(advances))
+    n = len(line)
+    wrapped, pos = [], 0
+
+    def fits(end):
+        return text_width(draw, line[pos:end], font) <= max_width
+
+    while pos < n:
+        # 每行至少包含一个字符
+        end = max(pos + 1, min(n, bisect.bisect_right(cum, cum[pos] + max_width) - 1))
+        if fits(end):
+            while end < n and fits(end + 1):
+                end += 1
+        else:
+            end -= 1
+            while end > pos + 1 and not fits(end):
+                end -= 1
+            end = max(end, pos + 1)
+        wrapped.append(line[pos:end])
+        pos = end
+    return wrapped
+
+
+def wrap_text_to_width(text: str, font, max_width: int, draw) -> str:
+    """将文本根据最大宽度自动换行"""
+    if not text or max_width <= 0:
+        return text
+
+    # 如果已经有手动换行，分别处理每一行
+    wrapped_lines = []
+    for line in text.split('\n'):
+        if not line:
+            wrapped_lines.append('')
+            continue
+        # 如果不超过最大宽度，直接添加
+        if text_width(draw, line, font) <= max_width:
+            wrapped_lines.append(line)
+            continue
+        wrapped_lines.extend(_wrap_line(line, font, max_width, draw))
+
+    return '\n'.join(wrapped_lines)
@@ -0,0 +1,423 @@
+import copy
+import functools
+import json
+import math
+import os
+import queue
+import subprocess
+import threading
+import time
+import uuid
+import imageio_ffmpeg
+import numpy as np
+from pathlib import Path
+from PIL import Image
+from typing import Any, Callable, Dict, Iterable, Iterator, List, Optional, Tuple
+
+LayoutFn = Callable[[int, int], Tuple[int, int, int, int]]
+
+# 上传视频的低分辨率代理：宽度不超过默认画布宽度，帧率不超过动态菜单可用的最高帧率
+VIDEO_PROXY_WIDTH = 1000
+VIDEO_PROXY_MAX_FPS = 30
+VIDEO_PROXY_CRF = 18
+
+
+def probe_video(video_path: Path) -> Dict[str, Any]:
+    """只读取 ffmpeg 输出的元数据（fps/duration/size），不解码帧；按 (路径, mtime, 大小) 缓存"""
+    st = video_path.stat()
+    return dict(_probe_video(str(video_path), st.st_mtime_ns, st.st_size))
+
+
+@functools.lru_cache(maxsize=64)
+def _probe_video(path: str, mtime_ns: int, size: int) -> Dict[str, Any]:
+    gen = imageio_ffmpeg.read_frames(path)
+    try:
+        return next(gen)
+    finally:
+        gen.close()
+
+
+def build_video_proxy(video_path: Path, proxy_path: Path, meta_path: Path) -> Optional[Dict[str, Any]]:
+    """
+    生成视频代理与元数据文件（fps/duration/size 以及原视频的尺寸 origin_size、帧率与 mtime/大小），返回元数据；
+    代理关键帧间隔 1 秒，跳转时只需解码少量帧；原视频不超过宽度与帧率上限时不生成，返回 None
+    """
+    meta = probe_video(video_path)
+    src_w, src_h = meta["size"]
+    src_fps = meta.get("fps") or 30
+    if src_w <= VIDEO_PROXY_WIDTH and src_fps <= VIDEO_PROXY_MAX_FPS: return None
+
+    proxy_w = min(src_w, VIDEO_PROXY_WIDTH) // 2 * 2
+    proxy_h = max(2, int(round(src_h * proxy_w / src_w / 2)) * 2)
+    proxy_fps = min(src_fps, VIDEO_PROXY_MAX_FPS)
+    filters = f"scale={proxy_w}:{proxy_h}" + (f",fps={proxy_fps}" if proxy_fps < src_fps else "")
+    st = video_path.stat()
+
+    proxy_path.parent.mkdir(parents=True, exist_ok=True)
+    tmp_path = proxy_path.with_name(f"tmp_{uuid.uuid4().hex[:8]}_{proxy_path.name}")
+    try:
+        subprocess.run([imageio_ffmpeg.get_ffmpeg_exe(), "-y", "-v", "error", "-i", str(video_path), "-an",
+                        "-vf", filters, "-c:v", "libx264", "-preset", "veryfast", "-crf", str(VIDEO_PROXY_CRF),
+                        "-pix_fmt", "yuv420p", "-g", str(max(1, int(round(proxy_fps)))), str(tmp_path)],
+                       check=True, capture_output=True)
+        proxy_meta = probe_video(tmp_path)
+        os.replace(tmp_path, proxy_path)
+    finally:
+        if tmp_path.exists():
+            try:
+                tmp_path.unlink()
+            except:
+                pass
+
+    info = {"fps": proxy_meta.get("fps") or proxy_fps, "duration": proxy_meta.get("duration", 0),
+            "size": list(proxy_meta["size"]), "origin_size": [src_w, src_h], "source_fps": src_fps,
+            "source_mtime_ns": st.st_mtime_ns, "source_bytes": st.st_size}
+    tmp_meta = meta_path.with_name(f"tmp_{uuid.uuid4().hex[:8]}_{meta_path.name}")
+    tmp_meta.write_text(json.dumps(info), encoding="utf-8")
+    os.replace(tmp_meta, meta_path)
+    return info
+
+
+def load_video_proxy(video_path: Path, proxy_path: Path, meta_path: Path) -> Optional[Dict[str, Any]]:
+    """读取代理元数据；代理不存在或原视频在生成代理之后已被替换时返回 None"""
+    try:
+        info = json.loads(meta_path.read_text(encoding="utf-8"))
+        st = video_path.stat()
+        if info.get("source_mtime_ns") != st.st_mtime_ns or info.get("source_bytes") != st.st_size: return None
+        return info if proxy_path.exists() else None
+    except (OSError, ValueError):
+        return None
+
+
+def select_frame_range(src_fps: float, start_t: float, end_limit: float, step: int,
+                       max_frames: int) -> Tuple[int, int]:
+    """
+    返回 (首帧序号, 帧数)，与从第 0 帧逐帧遍历、保留 start_t <= i/src_fps <= end_limit
+    且 i % step == 0 的帧完全相同
+    """
+    first = max(0, int(math.ceil(start_t * src_fps)) - 1)
+    while first / src_fps < start_t: first += 1
+    first = -(-first // step) * step
+    last = int(end_limit * src_fps) + 1
+    while last >= 0 and last / src_fps > end_limit: last -= 1
+    if last < first: return first, 0
+    return first, min(max_frames, (last - first) // step + 1)
+
+
+def read_video_frames(video_path: Path, src_fps: float, first: int, count: int, step: int,
+                      window: Optional[Tuple[int, int, int, int]] = None) -> Iterator[np.ndarray]:
+    """
+    只解码需要写出的帧：输入端跳转到首帧，select 按 step 抽帧，
+    window=(x, y, 宽, 高) 时由 ffmpeg 裁剪出实际会被取样的源区域
+    """
+    if count <= 0: return
+    filters = []
+    if step > 1: filters.append(f"select=not(mod(n\\,{step}))")
+    if window: filters.append("crop={2}:{3}:{0}:{1}".format(*window))
+    # 跳转到首帧之前半帧处，精确跳转会丢弃此前的帧，select 的帧号从首帧开始计数
+    input_params = ["-ss", f"{(first - 0.5) / src_fps:.6f}"] if first > 0 else []
+    output_params = ["-vsync", "passthrough", "-frames:v", str(count)]
+    if filters: output_params = ["-vf", ",".join(filters)] + output_params
+    gen = imageio_ffmpeg.read_frames(str(video_path), input_params=input_params, output_params=output_params)
+    try:
+        w, h = next(gen)["size"]
+        for raw in gen:
+            yield np.frombuffer(raw, dtype=np.uint8).reshape(h, w, 3)
+    finally:
+        gen.close()
+
+
+def _nearest_index(src: int, dst: int) -> np.ndarray:
+    """
+    PIL NEAREST 缩放的取样下标：从 0.5 倍步长开始逐个累加步长后取整
+    （按 PIL 的累加顺序计算，浮点误差与其一致）
+    """
+    steps = np.full(dst, src / dst)
+    steps[0] *= 0.5
+    idx = np.cumsum(steps).astype(np.intp)
+    np.clip(idx, 0, src - 1, out=idx)
+    return idx
+
+
+def _even_window(start: int, end: int, size: int) -> Tuple[int, int]:
+    """
+    将源区域 [start, end) 扩展到偶数起点和偶数长度：yuv420 等色度抽样格式只有按偶数裁剪时，
+    ffmpeg 裁剪后的转换结果才与整帧转换后再截取一致；奇数边长的源贴边时不裁剪该方向
+    """
+    start -= start % 2
+    end = min(size, end + (end - start) % 2)
+    if (end - start) % 2: return 0, size
+    return start, end - start
+
+
+class VideoCompositor:
+    """
+    视频模式逐帧合成
+    前景（菜单图层）与画布底色在整段视频中不变，只有视频覆盖的矩形区域每帧变化：
+    - 视频区域之外: 底色+前景只合成一次，作为所有帧共用的静态部分
+    - 视频区域之内: 预先计算前景的 色值*alpha 与 255-alpha，每帧最近邻缩放（预计算下标取样）
+      到预分配缓冲区后原地混合，结果与 PIL alpha_composite 逐像素一致
+    返回的帧缓冲区会被下一帧复用，写入器如需保留帧须自行复制
+    """
+
+    def __init__(self, foreground: Image.Image, canvas_rgb: Tuple[int, int, int], layout_fn: LayoutFn):
+        self.foreground = foreground.convert("RGBA") if foreground.mode != "RGBA" else foreground
+        self.canvas_rgb = tuple(canvas_rgb[:3])
+        self.layout_fn = layout_fn
+        self.cw, self.ch = self.foreground.size
+
+        base = Image.new("RGBA", (self.cw, self.ch), self.canvas_rgb + (255,))
+        base.alpha_composite(self.foreground)
+        self._static = np.array(base)
+        self._fg = np.asarray(self.foreground)
+        self._out = self._static.copy()
+        self._frame_shape = None
+        self._rect = None
+        self._dirty = None
+        self._window = None
+
+    @property
+    def static_frame(self) -> np.ndarray:
+        """视频不在画布内时每帧都相同的底色+前景"""
+        return self._static
+
+    @property
+    def dirty_rect(self) -> Optional[Tuple[int, int, int, int]]:
+        """帧间可能变化的画布区域 (x1, y1, x2, y2)：视频区域去掉边缘处完全不透明的前景，plan 之后可用"""
+        return self._dirty
+
+    def plan(self, src_w: int, src_h: int) -> Optional[Tuple[int, int, int, int]]:
+        """
+        按视频源尺寸准备合成参数，返回实际会被取样的源区域 (x, y, 宽, 高)，
+        之后 composite 接收裁剪到该区域的帧；视频不在画布内时返回 None
+        """
+        self._prepare(src_h, src_w, crop=True)
+        return self._window
+
+    def _prepare(self, src_h: int, src_w: int, crop: bool = False):
+        """根据视频源尺寸计算视频区域、取样下标和前景混合系数"""
+        self._frame_shape = (src_h, src_w)
+        self._out[:] = self._static
+        new_w, new_h, px, py = self.layout_fn(src_w, src_h)
+        x1, x2 = max(0, px), min(self.cw, px + new_w)
+        y1, y2 = max(0, py), min(self.ch, py + new_h)
+        if new_w <= 0 or new_h <= 0 or x2 <= x1 or y2 <= y1:
+            self._rect = self._dirty = self._window = None
+            return
+        self._rect = (x1, y1, x2, y2)
+        see_through = self._fg[y1:y2, x1:x2, 3] < 255
+        rows_any, cols_any = np.flatnonzero(see_through.any(axis=1)), np.flatnonzero(see_through.any(axis=0))
+        if rows_any.size:
+            self._dirty = (x1 + int(cols_any[0]), y1 + int(rows_any[0]), x1 + int(cols_any[-1]) + 1,
+                           y1 + int(rows_any[-1]) + 1)
+        else:
+            self._dirty = None
+
+        cols = _nearest_index(src_w, new_w)[x1 - px:x2 - px]
+        rows = _nearest_index(src_h, new_h)[y1 - py:y2 - py]
+        wx, ww = _even_window(int(cols[0]), int(cols[-1]) + 1, src_w) if crop else (0, src_w)
+        wy, wh = _even_window(int(rows[0]), int(rows[-1]) + 1, src_h) if crop else (0, src_h)
+        self._window = (wx, wy, ww, wh)
+        self._frame_shape = (wh, ww)
+        self._index = (rows[:, None] - wy) * ww + (cols[None, :] - wx)
+
+        h, w = y2 - y1, x2 - x1
+        fg = self._fg[y1:y2, x1:x2].astype(np.uint16)
+        alpha = fg[..., 3:4]
+        # 目标 alpha 恒为 255 时 PIL 的混合为 (src*a + dst*(255-a) + 128) 再近似除以 255，
+        # 这里预先算好 src*a+128 与 255-a；第 4 通道取 inv=0，结果恒为 255
+        self._fg_term = np.empty((h, w, 4), dtype=np.uint16)
+        np.multiply(fg[..., :3], alpha, out=self._fg_term[..., :3])
+        self._fg_term[..., :3] += 128
+        self._fg_term[..., 3] = 255 * 255 + 128
+        self._inv_alpha = np.zeros((h, w, 4), dtype=np.uint16)
+        self._inv_alpha[..., :3] = 255 - alpha
+
+        self._index = self._index.reshape(-1)
+        self._alloc_scratch()
+
+    def _alloc_scratch(self):
+        """每帧复用的临时缓冲区（每个合成线程各自一份）"""
+        x1, y1, x2, y2 = self._rect
+        h, w = y2 - y1, x2 - x1
+        wh, ww = self._frame_shape
+        # 源帧复制到末尾多 1 字节的缓冲区后按 3 字节步长视为 uint32，一次取样 4 字节（第 4 字节无用）
+        self._raw = np.zeros(wh * ww * 3 + 1, dtype=np.uint8)
+        self._src_px = np.ndarray((wh * ww,), dtype=np.uint32, buffer=self._raw, strides=(3,))
+        self._bg_buf = np.empty((h, w, 4), dtype=np.uint8)
+        self._work = np.empty((h, w, 4), dtype=np.uint16)
+        self._tmp = np.empty((h, w, 4), dtype=np.uint16)
+        self._tmp2 = np.empty((h, w, 4), dtype=np.uint16)
+
+    def fork(self) -> "VideoCompositor":
+        """共享预计算数据、拥有独立临时缓冲区的副本，供多个合成线程并行使用"""
+        other = copy.copy(self)
+        other._out = self._static.copy()
+        if self._rect is not None: other._alloc_scratch()
+        return other
+
+    def composite(self, frame: np.ndarray, out: Optional[np.ndarray] = None) -> np.ndarray:
+        """
+        将一帧视频（H×W×3 uint8）与前景合成为 RGBA 帧
+        out 为调用方提供的输出帧（视频区域之外须已是 static_frame 的内容），否则使用复用的内部缓冲区
+        """
+        if out is None: out = self._out
+        if self._frame_shape != frame.shape[:2]:
+            self._prepare(*frame.shape[:2])
+            if out is not self._out: out[:] = self._static
+        if self._rect is None:
+            return out
+
+        x1, y1, x2, y2 = self._rect
+        self._raw[:-1] = frame.reshape(-1)
+        np.take(self._src_px, self._index, out=self._bg_buf.reshape(-1).view(np.uint32))
+
+        # t = bg*(255-a) + src*a + 128 不超过 65153，全程 uint16 计算
+        # PIL 的 SHIFTFORDIV255 (PRECISION_BITS=7) 等价于 (t>>8) + ((((t&255)<<7) + (t>>1)) >> 15)
+        work, tmp, tmp2 = self._work, self._tmp, self._tmp2
+        np.multiply(self._bg_buf, self._inv_alpha, out=work)
+        work += self._fg_term
+        np.bitwise_and(work, 255, out=tmp)
+        np.left_shift(tmp, 7, out=tmp)
+        np.right_shift(work, 1, out=tmp2)
+        tmp += tmp2
+        np.right_shift(tmp, 15, out=tmp)
+        np.right_shift(work, 8, out=work)
+        np.add(work, tmp, out=out[y1:y2, x1:x2], casting="unsafe")
+        return out
+
+
+_DONE = object()
+
+
+def composite_stream(frames: Iterable[np.ndarray], compositor: VideoCompositor,
+                     sink: Callable[[np.ndarray], None], workers: int = 2, depth: int = 4) -> Dict[str, float]:
+    """
+    解码 → 合成 → 编码 三段流水线
+    - 解码线程: 迭代 frames（ffmpeg 管道读取），按帧序号从输出缓冲池取得输出帧后送入合成队列
+    - 合成线程 (workers 个): 各自持有 compositor 的副本，将视频帧合成到输出帧
+    - 编码（调用线程）: 按帧序号重排后依次交给 sink，写完后归还输出帧
+    队列与缓冲池均有界，任一阶段变慢时上游随之阻塞；输出帧按序号顺序分配，乱序完成也不会死锁
+    sink 返回后输出帧即被复用，需要保留帧的写入器须自行复制
+    workers=0 时在调用线程内顺序执行（单核主机上线程只会带来切换开销）
+    返回帧数、总耗时及各阶段 帧/秒（按该阶段实际工作时间计算）
+    """
+    busy = {"decode": 0.0, "composite": 0.0, "encode": 0.0}
+    start = time.perf_counter()
+
+    def result(n):
+        def fps(stage):
+            return round(n / busy[stage], 1) if busy[stage] > 0 else 0.0
+
+        return {"frames": n, "seconds": round(time.perf_counter() - start, 3), "workers": workers,
+                "decode_fps": fps("decode"), "composite_fps": fps("composite"), "encode_fps": fps("encode")}
+
+    if workers <= 0:
+        n, it = 0, iter(frames)
+        while True:
+            t0 = time.perf_counter()
+            frame = next(it, None)
+            if frame is None: break
+            t1 = time.perf_counter()
+            out = compositor.composite(frame)
+            t2 = time.perf_counter()
+            sink(out)
+            busy["decode"] += t1 - t0
+            busy["composite"] += t2 - t1
+            busy["encode"] += time.perf_counter() - t2
+            n += 1
+        return result(n)
+
+    stop = threading.Event()
+    errors: List[BaseException] = []
+    in_q: "queue.Queue" = queue.Queue(depth)
+    out_q: "queue.Queue" = queue.Queue()
+    pool: "queue.Queue" = queue.Queue()
+    for _ in range(depth + workers + 1):
+        pool.put(compositor.static_frame.copy())
+    busy_lock = threading.Lock()
+
+    def put(q, item) -> bool:
+        while not stop.is_set():
+            try:
+                q.put(item, timeout=0.1)
+                return True
+            except queue.Full:
+                continue
+        return False
+
+    def get(q):
+        while not stop.is_set():
+            try:
+                return q.get(timeout=0.1)
+            except queue.Empty:
+                continue
+        return _DONE
+
+    def decode():
+        it = iter(frames)
+        try:
+            seq = 0
+            while True:
+                buf = get(pool)
+                if buf is _DONE: break
+                t = time.perf_counter()
+                frame = next(it, None)
+                busy["decode"] += time.perf_counter() - t
+                if frame is None or not put(in_q, (seq, frame, buf)): break
+                seq += 1
+        except BaseException as e:
+            errors.append(e)
+            stop.set()
+        finally:
+            close = getattr(it, "close", None)
+            if close: close()
+            for _ in range(workers):
+                put(in_q, _DONE)
+
+    def composite(comp: VideoCompositor):
+        try:
+            while True:
+                item = get(in_q)
+                if item is _DONE: break
+                seq, frame, buf = item
+                t = time.perf_counter()
+                comp.composite(frame, out=buf)
+                with busy_lock:
+                    busy["composite"] += time.perf_counter() - t
+                out_q.put((seq, buf))
+        except BaseException as e:
+            errors.append(e)
+            stop.set()
+        finally:
+            out_q.put(_DONE)
+
+    threads = [threading.Thread(target=decode, name="menu_video_decode", daemon=True)]
+    threads += [threading.Thread(target=composite, args=(compositor.fork(),), name=f"menu_video_composite_{i}",
+                                 daemon=True) for i in range(workers)]
+    for th in threads: th.start()
+
+    pending: Dict[int, np.ndarray] = {}
+    next_seq, finished = 0, 0
+    try:
+        while finished < workers:
+            item = out_q.get()
+            if item is _DONE:
+                finished += 1
+                continue
+            seq, buf = item
+            pending[seq] = buf
+            while next_seq in pending and not stop.is_set():
+                buf = pending.pop(next_seq)
+                t = time.perf_counter()
+                sink(buf)
+                busy["encode"] += time.perf_counter() - t
+                pool.put(buf)
+                next_seq += 1
+    except BaseException as e:
+        errors.append(e)
+    finally:
+        stop.set()
+        for th in threads: th.join()
+    if errors: raise errors[0]
+    return result(next_seq)
@@ -344,7 +344,8 @@ function createNewMenu() {
         bg_align_y: "center",
         video_scale: 1.0,
         video_fps: 12,
-        video_export_format: "webp"
+        video_export_format: "webp",
+        video_encoder: "auto"
     };
 
     if (!appState.fullConfig.menus) appState.fullConfig.menus = [];
@@ -419,6 +420,7 @@ function renderSelect(id, opts, sel, def) {
 function updateFormInputs(m) {
     setValue("menuNameInput", m.name);
     setValue("triggerKeywordsInput", m.trigger_keywords || "");
+    if (document.getElementById("cacheStrictInput")) document.getElementById("cacheStrictInput").checked = !!m.cache_strict;
 
     setValue("columnInput", m.layout_columns || 3);
     setValue("cvsW", m.canvas_width || 1000);
@@ -457,6 +459,7 @@ function updateFormInputs(m) {
     setValue("vEnd", m.video_end || "");
     setValue("vFps", m.video_fps || 12);
     setValue("vFormat", m.video_export_format || "webp");
+    setValue("vEncoder", m.video_encoder || "auto");
 
     toggleBgPanel();
 
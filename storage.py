@@ -3,8 +3,13 @@ import uuid
 import shutil
 import sys
 import os
+import re
+import time
+import hashlib
+import threading
+import contextlib
 from pathlib import Path
-from typing import Dict, Any, Optional, List
+from typing import Dict, Any, Optional, List, Tuple
 
 try:
     from astrbot.api.star import StarTools
@@ -17,6 +22,31 @@ except ImportError:
 
     logger = logging.getLogger(__name__)
 
+# 不影响渲染结果的字段，不参与缓存键计算
+_CACHE_KEY_IGNORED_FIELDS = ("name", "enabled", "trigger_keywords", "cache_strict")
+# 输出缓存文件名: menu_{id}_{key}[_bg{index}|_poster].{ext}
+_CACHE_FILE_RE = re.compile(r"^menu_(?P<id>.+)_(?P<key>[0-9a-f]{16})(?:_(?P<variant>bg\d+|poster))?$")
+# 渲染时未指定字体的默认回退
+_DEFAULT_FONTS = ("title.ttf", "text.ttf")
+# 配置快照的 mtime/size 复查间隔（秒），间隔内的消息不触碰磁盘
+CONFIG_STAT_INTERVAL = 2.0
+# 超过该时长（秒）的临时输出文件视为中断残留，清理时删除
+TEMP_OUTPUT_MAX_AGE = 3600
+
+
+class ConfigSnapshot:
+    """menu.json 的解析快照，只读共享；每次重新加载后 version 递增"""
+    __slots__ = ("version", "data", "signature")
+
+    def __init__(self, version: int, data: Dict[str, Any], signature: Optional[tuple]):
+        self.version = version
+        self.data = data
+        self.signature = signature
+
+    @property
+    def menus(self) -> List[Dict[str, Any]]:
+        return self.data.get("menus", [])
+
 
 class PluginStorage:
     _instance = None
@@ -37,8 +67,14 @@ class PluginStorage:
         self.img_dir: Optional[Path] = None
         self.video_dir: Optional[Path] = None
         self.outputs_dir: Optional[Path] = None
+        self.exports_dir: Optional[Path] = None
+        self.proxy_dir: Optional[Path] = None
         self.menu_file: Optional[Path] = None
         self.fonts_dir: Optional[Path] = None
+        self._snapshot: Optional[ConfigSnapshot] = None
+        self._snapshot_dirty = False
+        self._snapshot_checked_at = 0.0
+        self._snapshot_lock = threading.Lock()
         self._initialized = True
 
     def init_paths(self, custom_data_dir: str = None):
@@ -55,6 +91,10 @@ class PluginStorage:
         self.img_dir = self.assets_dir / "widgets"
         self.video_dir = self.assets_dir / "videos"
         self.outputs_dir = self.data_dir / "outputs"
+        # 编辑器导出的渲染结果（可能是未保存的草稿），不放进 outputs，避免被当作菜单的旧版本输出发送
+        self.exports_dir = self.data_dir / "exports"
+        # 上传视频的低分辨率代理，不属于素材，不参与打包导出
+        self.proxy_dir = self.data_dir / "video_proxies"
         self.menu_file = self.data_dir / "menu.json"
         self.fonts_dir = self.assets_dir / "fonts"
         self._init_directories()
@@ -68,6 +108,8 @@ class PluginStorage:
             self.img_dir.mkdir(parents=True, exist_ok=True)
             self.video_dir.mkdir(parents=True, exist_ok=True)
             self.outputs_dir.mkdir(parents=True, exist_ok=True)
+            self.exports_dir.mkdir(parents=True, exist_ok=True)
+            self.proxy_dir.mkdir(parents=True, exist_ok=True)
             self.fonts_dir.mkdir(parents=True, exist_ok=True)
 
             source_fonts = self.base_dir / "fonts"
@@ -112,6 +154,7 @@ class PluginStorage:
             "video_frame_ratio": 1,
             "video_scale": 1.0,
             "video_export_format": "apng",
+            "video_encoder": "auto",
             "background": "",
             "bg_fit_mode": "cover_w",
             "bg_custom_width": 1000,
@@ -163,19 +206,70 @@ class PluginStorage:
         }
 
     def load_config(self) -> Dict[str, Any]:
-        default_root = {"version": 16, "menus": [self.create_default_menu()]}
-        if not self.menu_file or not self.menu_file.exists():
-            if self.menu_file: self.save_config(default_root)
-            return default_root
         try:
-            data = json.loads(self.menu_file.read_text(encoding="utf-8"))
-            return data
+            return self._read_config()
         except Exception:
+            return {"version": 16, "menus": [self.create_default_menu()]}
+
+    def _read_config(self) -> Dict[str, Any]:
+        """读取 menu.json，文件不存在时写入默认配置；解析失败时抛出异常"""
+        if not self.menu_file or not self.menu_file.exists():
+            default_root = {"version": 16, "menus": [self.create_default_menu()]}
+            if self.menu_file: self.save_config(default_root)
             return default_root
+        return json.loads(self.menu_file.read_text(encoding="utf-8"))
 
     def save_config(self, data: Dict[str, Any]):
         if self.menu_file:
-            self.menu_file.write_text(json.dumps(data, indent=2, ensure_ascii=False), encoding="utf-8")
+            # 先写临时文件再原子替换，其他进程不会读到写了一半的配置
+            with self.atomic_output(self.menu_file) as tmp_path:
+                tmp_path.write_text(json.dumps(data, indent=2, ensure_ascii=False), encoding="utf-8")
+            self.invalidate_config_snapshot()
+
+    def _menu_file_signature(self) -> Optional[tuple]:
+        try:
+            st = self.menu_file.stat()
+            return st.st_mtime_ns, st.st_size
+        except (OSError, AttributeError):
+            return None
+
+    def invalidate_config_snapshot(self):
+        """标记快照失效（本进程保存或 Web 进程通知保存后调用），下次访问时重新加载"""
+        self._snapshot_dirty = True
+
+    def get_cached_config_snapshot(self) -> Optional[ConfigSnapshot]:
+        """在复查间隔内且未失效时直接返回内存快照，否则返回 None（需调用 get_config_snapshot）"""
+        snap = self._snapshot
+        if snap is None or self._snapshot_dirty: return None
+        if time.monotonic() - self._snapshot_checked_at >= CONFIG_STAT_INTERVAL: return None
+        return snap
+
+    def get_config_snapshot(self) -> ConfigSnapshot:
+        """返回解析后的配置快照，仅当 menu.json 的 mtime/size 变化或被标记失效时重新读取"""
+        with self._snapshot_lock:
+            snap = self._snapshot
+            signature = self._menu_file_signature()
+            if snap is not None and not self._snapshot_dirty and signature is not None \
+                    and signature == snap.signature:
+                self._snapshot_checked_at = time.monotonic()
+                return snap
+
+            # 签名取自读取之前：读取期间文件再被修改时签名不一致，下次复查会重新加载
+            self._snapshot_dirty = False
+            self._snapshot_checked_at = time.monotonic()
+            try:
+                data = self._read_config()
+            except Exception as e:
+                if snap is not None:
+                    # 解析失败（如文件正被其他程序写入），沿用上一份快照，签名不变以便下次复查重试
+                    logger.warning(f"菜单配置解析失败，继续使用上一份配置: {e}")
+                    return snap
+                # 没有可沿用的快照时不缓存结果，下次访问重新读取
+                logger.warning(f"菜单配置解析失败: {e}")
+                return ConfigSnapshot(0, {"version": 16, "menus": []}, None)
+            version = snap.version + 1 if snap else 1
+            self._snapshot = ConfigSnapshot(version, data, signature)
+            return self._snapshot
 
     def get_assets_list(self) -> Dict[str, list]:
         def scan(path: Path, exts: list):
@@ -190,11 +284,72 @@ class PluginStorage:
             "videos": scan(self.video_dir, ['.mp4', '.mov', '.webm', '.avi', '.mkv'])
         }
 
-    def get_menu_output_cache_path(self, menu_id: str, is_video: bool, output_format: str = "png", bg_index: int = None) -> Path:
-        """获取菜单输出缓存路径，bg_index用于随机背景的索引"""
+    def iter_menu_assets(self, menu_data: Dict[str, Any]) -> List[Path]:
+        """收集菜单引用的全部素材路径（背景、视频、图标、字体、组件图片）"""
+        if not self.assets_dir: self.init_paths()
+        refs = []
+
+        def add(folder: Path, name):
+            if name and isinstance(name, str): refs.append(folder / name)
+
+        def add_fonts(obj: Dict[str, Any]):
+            for k, v in obj.items():
+                if k == "font" or k.endswith("_font"): add(self.fonts_dir, v)
+
+        add(self.bg_dir, menu_data.get("background"))
+        for bg in menu_data.get("backgrounds") or []: add(self.bg_dir, bg)
+        add(self.video_dir, menu_data.get("bg_video"))
+        for name in _DEFAULT_FONTS: add(self.fonts_dir, name)
+        add_fonts(menu_data)
+        for group in menu_data.get("groups") or []:
+            add_fonts(group)
+            for item in group.get("items") or []:
+                add_fonts(item)
+                add(self.icon_dir, item.get("icon"))
+        for widget in menu_data.get("custom_widgets") or []:
+            add_fonts(widget)
+            if widget.get("type") == "image": add(self.img_dir, widget.get("content"))
+        return sorted(set(refs))
+
+    def get_video_proxy_paths(self, video_name: str) -> Tuple[Path, Path]:
+        """视频代理文件与其元数据文件的路径"""
+        if not self.proxy_dir: self.init_paths()
+        return self.proxy_dir / f"{video_name}.proxy.mp4", self.proxy_dir / f"{video_name}.proxy.json"
+
+    def remove_video_proxy(self, video_name: str):
+        for path in self.get_video_proxy_paths(video_name):
+            try:
+                path.unlink()
+            except:
+                pass
+
+    def compute_menu_cache_key(self, menu_data: Dict[str, Any]) -> str:
+        """基于菜单内容与所引用素材的 mtime/大小计算稳定的缓存键"""
+        content = {k: v for k, v in menu_data.items() if k not in _CACHE_KEY_IGNORED_FIELDS}
+        h = hashlib.sha1(json.dumps(content, sort_keys=True, ensure_ascii=False, default=str).encode("utf-8"))
+        for path in self.iter_menu_assets(menu_data):
+            try:
+                st = path.stat()
+                stamp = f"{st.st_mtime_ns}:{st.st_size}"
+            except OSError:
+                stamp = "missing"
+            h.update(f"|{path.parent.name}/{path.name}:{stamp}".encode("utf-8"))
+        video = menu_data.get("bg_video")
+        if video and isinstance(video, str):
+            # 代理生成/删除后改为读取代理/原视频，输出会有细微差异，需要重新渲染；元数据文件最后写入，以它为准
+            try:
+                st = self.get_video_proxy_paths(video)[1].stat()
+                h.update(f"|proxy:{st.st_mtime_ns}:{st.st_size}".encode("utf-8"))
+            except OSError:
+                h.update(b"|proxy:none")
+        return h.hexdigest()[:16]
+
+    def get_menu_output_cache_path(self, menu_data: Dict[str, Any], is_video: bool, output_format: str = "png",
+                                   bg_index: int = None, cache_key: str = None, poster: bool = False) -> Path:
+        """获取菜单输出缓存路径（按内容寻址），bg_index用于随机背景的索引，poster 为动态菜单的静态封面"""
         if not self.outputs_dir: self.init_paths()
 
-        if not is_video:
+        if not is_video or poster:
             ext = "png"
         else:
             fmt = output_format.lower()
@@ -207,48 +362,161 @@ class PluginStorage:
             else:
                 ext = 'png'
 
+        key = cache_key or self.compute_menu_cache_key(menu_data)
+        stem = f"menu_{menu_data.get('id')}_{key}"
         # 如果有背景索引，添加到文件名中
         if bg_index is not None:
-            return self.outputs_dir / f"menu_{menu_id}_bg{bg_index}.{ext}"
-        return self.outputs_dir / f"menu_{menu_id}.{ext}"
+            return self.outputs_dir / f"{stem}_bg{bg_index}.{ext}"
+        if poster:
+            return self.outputs_dir / f"{stem}_poster.{ext}"
+        return self.outputs_dir / f"{stem}.{ext}"
+
+    def get_menu_export_path(self, menu_data: Dict[str, Any], is_video: bool, output_format: str = "png") -> Path:
+        """编辑器导出的输出路径，文件名与输出缓存相同，但位于 exports 目录"""
+        if not self.exports_dir: self.init_paths()
+        return self.exports_dir / self.get_menu_output_cache_path(menu_data, is_video, output_format).name
+
+    def prune_menu_exports(self, menu_id: str, keep: Path):
+        """每个菜单只保留最近一次导出的结果"""
+        if not self.exports_dir or not self.exports_dir.exists(): return
+        for f in self.exports_dir.glob("menu_*.*"):
+            info = self.parse_cache_file_name(f)
+            if info is None or info["id"] != menu_id or f == keep: continue
+            try:
+                f.unlink()
+            except:
+                pass
 
-    def get_random_bg_cache_paths(self, menu_id: str, bg_count: int) -> list:
+    def get_random_bg_cache_paths(self, menu_data: Dict[str, Any], bg_count: int) -> list:
         """获取随机背景的所有缓存路径"""
-        if not self.outputs_dir: self.init_paths()
-        return [self.outputs_dir / f"menu_{menu_id}_bg{i}.png" for i in range(bg_count)]
+        key = self.compute_menu_cache_key(menu_data)
+        return [self.get_menu_output_cache_path(menu_data, False, "png", bg_index=i, cache_key=key)
+                for i in range(bg_count)]
+
+    @staticmethod
+    def parse_cache_file_name(path: Path) -> Optional[Dict[str, str]]:
+        """解析缓存文件名，返回 {id, key, variant}；旧格式或无关文件返回 None"""
+        m = _CACHE_FILE_RE.match(path.stem)
+        return m.groupdict() if m else None
+
+    @contextlib.contextmanager
+    def atomic_output(self, final_path: Path):
+        """先写入同目录临时文件，成功后原子替换为最终文件，避免读取/发送写了一半的缓存"""
+        tmp_path = final_path.with_name(f"tmp_{uuid.uuid4().hex[:8]}_{final_path.name}")
+        try:
+            yield tmp_path
+            os.replace(tmp_path, final_path)
+        finally:
+            if tmp_path.exists():
+                try:
+                    tmp_path.unlink()
+                except:
+                    pass
+
+    def _menu_output_generations(self, menu_id: str) -> Dict[str, List[Path]]:
+        """菜单的全部输出缓存按缓存键分组: {缓存键: [文件]}，随机背景的各版本属于同一组"""
+        generations = {}
+        if not self.outputs_dir or not self.outputs_dir.exists(): return generations
+        for f in self.outputs_dir.glob("menu_*.*"):
+            info = self.parse_cache_file_name(f)
+            if info and info["id"] == menu_id: generations.setdefault(info["key"], []).append(f)
+        return generations
+
+    @staticmethod
+    def _newest_generation(generations: Dict[str, List[Path]]) -> Optional[str]:
+        def newest_mtime(files):
+            try:
+                return max(f.stat().st_mtime for f in files)
+            except OSError:
+                return 0
+        return max(generations, key=lambda k: newest_mtime(generations[k]), default=None)
+
+    def find_stale_outputs(self, menu_id: str, current_key: str) -> List[Path]:
+        """
+        菜单内容变化前最近一次渲染的输出（随机背景为该次的全部版本），用于新版本渲染完成前先行发送；
+        动态菜单的静态封面排在动画之后
+        """
+        generations = self._menu_output_generations(menu_id)
+        generations.pop(current_key, None)
+        key = self._newest_generation(generations)
+        if not key: return []
+        return sorted((f for f in generations[key] if f.exists()), key=lambda f: f.stem.endswith("_poster"))
+
+    def prune_stale_outputs(self, menu_id: str, current_key: str, before: Optional[float] = None):
+        """
+        新版本输出全部就绪后删除菜单的旧版本输出，以及已被动画取代的静态封面；
+        before 为新版本就绪的时间，之后生成的输出（菜单随后再次修改后的新版本）不删除
+        """
+        for key, files in self._menu_output_generations(menu_id).items():
+            for f in files:
+                if key == current_key and not f.stem.endswith("_poster"): continue
+                try:
+                    if before is not None and f.stat().st_mtime >= before: continue
+                    f.unlink()
+                except:
+                    pass
 
     def cleanup_unused_caches(self, current_menus: List[Dict]):
+        """
+        删除已删除/禁用菜单的缓存以及内容已变化的过期缓存，未变化的菜单缓存保持不动；
+        非严格模式 (cache_strict) 的菜单额外保留最近一版旧输出，新版本渲染完成前先发送它
+        """
         if not self.outputs_dir or not self.outputs_dir.exists(): return
 
-        valid_ids = {m['id'] for m in current_menus if m.get('enabled', True)}
-        all_ids = {m['id'] for m in current_menus}
+        enabled = [m for m in current_menus if m.get('enabled', True)]
+        valid_keys = {m['id']: self.compute_menu_cache_key(m) for m in enabled}
+        keep_stale = {m['id'] for m in enabled if not m.get('cache_strict')}
 
+        stale = {}
         for f in self.outputs_dir.glob("menu_*.*"):
             try:
-                stem = f.stem
-                if not stem.startswith("menu_"): continue
-                mid = stem[5:].split('_bg')[0]  # 处理随机背景缓存文件名
-                if mid not in all_ids or mid not in valid_ids:
+                info = self.parse_cache_file_name(f)
+                if info is None or info["id"] not in valid_keys:
                     f.unlink()
+                elif valid_keys[info["id"]] != info["key"]:
+                    stale.setdefault(info["id"], {}).setdefault(info["key"], []).append(f)
             except:
                 pass
 
-    def clear_menu_cache(self, menu_id: str):
-        if not self.outputs_dir: return
-        # 清除普通缓存
-        for ext in ['jpg', 'png', 'webp', 'gif']:
-            f = self.outputs_dir / f"menu_{menu_id}.{ext}"
-            if f.exists():
+        for menu_id, generations in stale.items():
+            keep = self._newest_generation(generations) if menu_id in keep_stale else None
+            for key, files in generations.items():
+                if key == keep: continue
+                for f in files:
+                    try:
+                        f.unlink()
+                    except:
+                        pass
+
+        menu_ids = {m.get('id') for m in current_menus}
+        if self.exports_dir and self.exports_dir.exists():
+            for f in self.exports_dir.glob("menu_*.*"):
+                info = self.parse_cache_file_name(f)
+                if info is not None and info["id"] in menu_ids: continue
                 try:
                     f.unlink()
                 except:
                     pass
-        # 清除随机背景缓存 (menu_{id}_bg{index}.png)
-        for f in self.outputs_dir.glob(f"menu_{menu_id}_bg*.png"):
+
+        now = time.time()
+        for d in (self.outputs_dir, self.exports_dir):
+            if not d or not d.exists(): continue
+            for f in d.glob("tmp_*"):
+                try:
+                    if now - f.stat().st_mtime > TEMP_OUTPUT_MAX_AGE:
+                        f.unlink()
+                except:
+                    pass
+
+    def clear_menu_cache(self, menu_id: str):
+        if not self.outputs_dir: return
+        for f in self.outputs_dir.glob("menu_*.*"):
+            info = self.parse_cache_file_name(f)
+            if info is None or info["id"] != menu_id: continue
             try:
                 f.unlink()
             except:
                 pass
 
 
-plugin_storage = PluginStorage()
\ No newline at end of file
+plugin_storage = PluginStorage()
@@ -0,0 +1,13 @@
+import sys
+import types
+from pathlib import Path
+
+ROOT = Path(__file__).resolve().parent.parent
+
+# 插件目录本身不是可安装的包，测试直接从插件根目录导入 renderer 等子模块
+sys.path.insert(0, str(ROOT))
+
+# render_pool 等模块使用相对导入，另以包的形式注册插件目录
+_plugin = types.ModuleType("custom_menu")
+_plugin.__path__ = [str(ROOT)]
+sys.modules.setdefault("custom_menu", _plugin)
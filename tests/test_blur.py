@@ -0,0 +1,28 @@
+import numpy as np
+import pytest
+from PIL import Image, ImageDraw, ImageFilter
+
+from renderer.blur import BLUR_FAST_EDGE_TOLERANCE, BLUR_FAST_RADIUS, BLUR_FAST_TOLERANCE, gaussian_blur
+
+
+def _photo():
+    rng = np.random.default_rng(0)
+    small = rng.integers(0, 256, (30, 20, 4), dtype=np.uint8)
+    small[..., 3] = 255
+    return Image.fromarray(small, "RGBA").resize((400, 600), Image.BICUBIC)
+
+
+def _shape(fill):
+    img = Image.new("RGBA", (400, 600), (0, 0, 0, 0))
+    ImageDraw.Draw(img).rectangle([(60, 80), (340, 300)], fill=fill)
+    return img
+
+
+@pytest.mark.parametrize("img", [_photo(), _shape((255, 255, 255, 255)), _shape((51, 51, 51, 200))],
+                         ids=["photo", "rect", "shadow"])
+@pytest.mark.parametrize("radius", [BLUR_FAST_RADIUS, 20, 30, 60])
+def test_fast_blur_within_tolerance(img, radius):
+    exact = np.asarray(img.filter(ImageFilter.GaussianBlur(radius=radius)), int)
+    diff = np.abs(exact - np.asarray(gaussian_blur(img, radius), int))
+    assert diff[2 * radius:-2 * radius, 2 * radius:-2 * radius].max() <= BLUR_FAST_TOLERANCE
+    assert diff.max() <= BLUR_FAST_EDGE_TOLERANCE
@@ -0,0 +1,11 @@
+from renderer.cache import LRUCache
+
+
+def test_take_counters_resets():
+    c = LRUCache("t", 10)
+    c.put("a", 1, 6)
+    c.get("a"), c.get("b")
+    c.put("b", 2, 6)
+
+    assert c.take_counters() == {"t_hits": 1, "t_misses": 1, "t_evictions": 1}
+    assert c.take_counters() == {"t_hits": 0, "t_misses": 0, "t_evictions": 0}
@@ -0,0 +1,56 @@
+import struct
+
+import numpy as np
+from PIL import Image, ImageSequence
+
+from renderer.encoders import APNG_MAX_DELAY, ApngDeltaEncoder
+
+
+def _fctl_delays(path):
+    data, pos, delays = path.read_bytes(), 8, []
+    while pos < len(data):
+        length, tag = struct.unpack(">I4s", data[pos:pos + 8])
+        if tag == b"fcTL":
+            num, den = struct.unpack(">HH", data[pos + 8 + 20:pos + 8 + 24])
+            delays.append(num * 1000 // den)
+        pos += 12 + length
+    return delays
+
+
+def test_apng_delta_long_static_run(tmp_path):
+    """2 fps 下 300 帧完全相同（150 秒）：合并后的延时不能超出 16 位，总时长保持不变"""
+    path = tmp_path / "static.png"
+    frame = np.zeros((8, 8, 4), np.uint8)
+    frame[..., 3] = 255
+    enc = ApngDeltaEncoder(path, "apng", 2, (8, 8))
+    for _ in range(300):
+        enc.append(frame)
+    enc.close()
+
+    delays = _fctl_delays(path)
+    assert len(delays) > 1
+    assert all(0 < d <= APNG_MAX_DELAY for d in delays)
+    assert sum(delays) == 150000
+    with Image.open(path) as im:
+        frames = [np.asarray(f.convert("RGBA")) for f in ImageSequence.Iterator(im)]
+    assert all((f == frame).all() for f in frames)
+
+
+def test_apng_delta_static_run_between_changes(tmp_path):
+    """长时间静止之后的变化帧仍按原时间显示"""
+    path = tmp_path / "mixed.png"
+    a = np.zeros((4, 4, 4), np.uint8)
+    a[..., 3] = 255
+    b = a.copy()
+    b[1, 1, :3] = 200
+    enc = ApngDeltaEncoder(path, "apng", 1, (4, 4))
+    for f in [a] * 100 + [b] * 2:
+        enc.append(f)
+    enc.close()
+
+    delays = _fctl_delays(path)
+    assert all(0 < d <= APNG_MAX_DELAY for d in delays)
+    assert sum(delays) == 102000
+    with Image.open(path) as im:
+        im.seek(im.n_frames - 1)
+        assert (np.asarray(im.convert("RGBA")) == b).all()
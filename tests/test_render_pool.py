@@ -0,0 +1,44 @@
+import asyncio
+import time
+
+import pytest
+
+from custom_menu.render_pool import RenderPool, RenderQueueFull
+
+
+def _gather(pool, *jobs):
+    async def run():
+        return await asyncio.gather(*(pool.submit(time.sleep, d) for d in jobs), return_exceptions=True)
+    try:
+        return asyncio.run(run())
+    finally:
+        pool.shutdown()
+
+
+def test_timeout_excludes_queue_time():
+    pool = RenderPool(max_workers=1, queue_limit=4, timeout=0.5, use_processes=False)
+    assert _gather(pool, 0.3, 0.3, 0.3) == [None, None, None]
+    assert pool.pending == 0
+
+
+def test_queue_limit_counts_waiting_jobs():
+    pool = RenderPool(max_workers=1, queue_limit=2, timeout=5, use_processes=False)
+    results = _gather(pool, 0.1, 0.1, 0.1)
+    assert sum(isinstance(r, RenderQueueFull) for r in results) == 1
+
+
+def test_timed_out_thread_keeps_its_slot():
+    pool = RenderPool(max_workers=1, queue_limit=4, timeout=0.2, use_processes=False)
+
+    async def run():
+        with pytest.raises(asyncio.TimeoutError):
+            await pool.submit(time.sleep, 0.5)
+        assert pool.pending == 1
+        # 超时的线程结束后名额才释放，后续任务的计时从那时开始
+        await pool.submit(time.sleep, 0.1)
+        assert pool.pending == 0
+
+    try:
+        asyncio.run(run())
+    finally:
+        pool.shutdown()
@@ -0,0 +1,86 @@
+import os
+
+import pytest
+
+from storage import PluginStorage
+
+
+@pytest.fixture
+def storage(tmp_path):
+    s = PluginStorage()
+    s.init_paths(str(tmp_path))
+    s.invalidate_config_snapshot()
+    return s
+
+
+def _touch(path):
+    path.write_bytes(b"x")
+    return path
+
+
+def test_export_does_not_become_stale_output(storage):
+    published = storage.create_default_menu("A")
+    draft = dict(published, title="draft")
+    out = _touch(storage.get_menu_output_cache_path(published, False))
+    export = _touch(storage.get_menu_export_path(draft, False))
+
+    assert export.parent != out.parent
+    current = storage.compute_menu_cache_key(dict(published, title="new"))
+    assert storage.find_stale_outputs(published["id"], current) == [out]
+
+
+def test_cleanup_removes_exports_of_deleted_menus(storage):
+    kept, removed = storage.create_default_menu("A"), storage.create_default_menu("B")
+    kept_export = _touch(storage.get_menu_export_path(kept, False))
+    removed_export = _touch(storage.get_menu_export_path(removed, False))
+
+    storage.cleanup_unused_caches([kept])
+    assert kept_export.exists() and not removed_export.exists()
+
+
+def test_snapshot_survives_half_written_config(storage):
+    storage.save_config({"version": 16, "menus": [storage.create_default_menu("A")]})
+    snap = storage.get_config_snapshot()
+
+    storage.menu_file.write_text('{"version": 16, "menus": [', encoding="utf-8")
+    storage.invalidate_config_snapshot()
+    assert storage.get_config_snapshot() is snap
+
+    storage.save_config({"version": 16, "menus": []})
+    assert storage.get_config_snapshot().version == snap.version + 1
+    assert not list(storage.data_dir.glob("tmp_*"))
+
+
+def test_unparsable_config_without_snapshot_is_not_cached(storage):
+    storage._snapshot = None
+    storage.menu_file.write_text("{", encoding="utf-8")
+    assert storage.get_config_snapshot().menus == []
+
+    storage.save_config({"version": 16, "menus": [storage.create_default_menu("A")]})
+    assert [m["name"] for m in storage.get_config_snapshot().menus] == ["A"]
+
+
+def test_cache_key_follows_video_proxy(storage):
+    menu = dict(storage.create_default_menu("A"), bg_type="video", bg_video="clip.mp4")
+    no_proxy = storage.compute_menu_cache_key(menu)
+
+    _, meta_path = storage.get_video_proxy_paths("clip.mp4")
+    meta_path.write_text("{}", encoding="utf-8")
+    with_proxy = storage.compute_menu_cache_key(menu)
+    assert with_proxy != no_proxy
+
+    storage.remove_video_proxy("clip.mp4")
+    assert storage.compute_menu_cache_key(menu) == no_proxy
+
+
+def test_prune_keeps_outputs_newer_than_cutoff(storage):
+    menu = storage.create_default_menu("A")
+    old = _touch(storage.get_menu_output_cache_path(menu, False))
+    current = dict(menu, title="v2")
+    current_out = _touch(storage.get_menu_output_cache_path(current, False))
+    os.utime(old, (1000, 1000))
+    os.utime(current_out, (2000, 2000))
+    newer = _touch(storage.get_menu_output_cache_path(dict(menu, title="v3"), False))
+
+    storage.prune_stale_outputs(menu["id"], storage.compute_menu_cache_key(current), before=3000)
+    assert not old.exists() and current_out.exists() and newer.exists()
@@ -50,12 +50,32 @@ def run_server(config_dict, status_queue, log_queue, data_dir=None, command_data
             import storage
             if data_dir: storage.plugin_storage.init_paths(data_dir)
             from storage import plugin_storage
-            from renderer.menu import render_static, render_animated
+            from render_pool import (IMAGE_SEND_MAX_BYTES, RenderPool, RenderQueueFull, build_video_proxy_job,
+                                     render_static_job, render_animated_job)
         except ImportError:
             from . import storage
             if data_dir: storage.plugin_storage.init_paths(data_dir)
             from .storage import plugin_storage
-            from .renderer.menu import render_static, render_animated
+            from .render_pool import (IMAGE_SEND_MAX_BYTES, RenderPool, RenderQueueFull, build_video_proxy_job,
+                                      render_static_job, render_animated_job)
+
+        # Web 后台运行在守护进程中，渲染池自动使用线程模式
+        render_pool = RenderPool.from_config(config_dict, str(plugin_storage.data_dir))
+
+        proxy_tasks = set()
+
+        def schedule_video_proxy(video_name: str):
+            """后台生成视频代理：转码耗时较长，不占用渲染池的队列与超时"""
+            async def job():
+                try:
+                    proxy = await asyncio.to_thread(build_video_proxy_job, video_name)
+                    if proxy: log_queue.put(("INFO", f"视频代理已生成: {video_name}"))
+                except Exception as e:
+                    log_queue.put(("WARNING", f"视频代理生成失败: {video_name}: {e}"))
+
+            task = asyncio.ensure_future(job())
+            proxy_tasks.add(task)
+            task.add_done_callback(proxy_tasks.discard)
 
         app = Quart(__name__, template_folder=str(PLUGIN_DIR / "templates"), static_folder=str(PLUGIN_DIR / "static"))
         app.secret_key = os.urandom(24)
@@ -92,12 +112,11 @@ def run_server(config_dict, status_queue, log_queue, data_dir=None, command_data
         async def save_cfg():
             data = await request.get_json()
             plugin_storage.save_config(data)
+            log_queue.put(("CONFIG", "saved"))
 
             if data and "menus" in data:
+                # 缓存按内容寻址，只清理内容已变化或已删除的菜单缓存
                 plugin_storage.cleanup_unused_caches(data["menus"])
-                for m in data["menus"]:
-                    if m.get("enabled", True):
-                        plugin_storage.clear_menu_cache(m.get("id"))
             return jsonify({"status": "ok"})
 
         @app.route("/api/assets", methods=["GET"])
@@ -116,7 +135,7 @@ def run_server(config_dict, status_queue, log_queue, data_dir=None, command_data
             if target_dir:
                 fname = f"{uuid.uuid4().hex[:8]}_{u_file.filename}"
                 await u_file.save(target_dir / fname)
-                for m in plugin_storage.load_config().get("menus", []): plugin_storage.clear_menu_cache(m.get("id"))
+                if form.get("type") == "video": schedule_video_proxy(fname)
                 return jsonify({"status": "ok", "filename": fname})
             return jsonify({"error": "Unknown type"}), 400
 
@@ -148,8 +167,8 @@ def run_server(config_dict, status_queue, log_queue, data_dir=None, command_data
             
             try:
                 file_path.unlink()
-                for m in plugin_storage.load_config().get("menus", []):
-                    plugin_storage.clear_menu_cache(m.get("id"))
+                if asset_type == "video": plugin_storage.remove_video_proxy(filename)
+                plugin_storage.cleanup_unused_caches(plugin_storage.load_config().get("menus", []))
                 return jsonify({"status": "ok"})
             except Exception as e:
                 return jsonify({"error": str(e)}), 500
@@ -188,32 +207,39 @@ def run_server(config_dict, status_queue, log_queue, data_dir=None, command_data
         @app.route("/api/export_image", methods=["POST"])
         async def export():
             m = await request.get_json()
-            m_id = m.get("id")
             is_video = (m.get("bg_type") == "video")
             fmt = "png"
             if is_video:
                 fmt = m.get("video_export_format", "apng")
 
-            cache_path = plugin_storage.get_menu_output_cache_path(m_id, is_video, fmt)
+            # 与机器人已渲染的版本内容相同时直接复用其缓存
+            cache_path = plugin_storage.get_menu_output_cache_path(m, is_video, fmt)
+            if cache_path.exists(): return await send_file(str(cache_path), as_attachment=True,
+                                                           attachment_filename=cache_path.name)
 
+            # 导出的可能是未保存的草稿，渲染到 exports 目录而不是输出缓存
+            cache_path = plugin_storage.get_menu_export_path(m, is_video, fmt)
             if cache_path.exists(): return await send_file(str(cache_path), as_attachment=True,
                                                            attachment_filename=cache_path.name)
+            plugin_storage.prune_menu_exports(m.get("id"), cache_path)
 
             try:
                 if is_video:
-                    out_path = await asyncio.to_thread(render_animated, m, cache_path)
+                    out_path = await render_pool.submit(render_animated_job, m, str(cache_path),
+                                                        IMAGE_SEND_MAX_BYTES)
                     if out_path:
+                        out_path = Path(out_path)
                         return await send_file(str(out_path), as_attachment=True, attachment_filename=out_path.name)
                     else:
                         return jsonify({"error": "Animated render failed"}), 500
                 else:
-                    img = await asyncio.to_thread(render_static, m)
-                    byte_io = BytesIO()
-                    await asyncio.to_thread(img.save, byte_io, 'PNG')
-                    byte_io.seek(0)
-                    cache_path.write_bytes(byte_io.getvalue())
-                    return await send_file(byte_io, mimetype='image/png', as_attachment=True,
+                    await render_pool.submit(render_static_job, m, str(cache_path))
+                    return await send_file(str(cache_path), mimetype='image/png', as_attachment=True,
                                            attachment_filename=f"{m.get('name')}.png")
+            except RenderQueueFull as e:
+                return jsonify({"error": str(e)}), 503
+            except asyncio.TimeoutError:
+                return jsonify({"error": "Render timeout"}), 504
             except Exception as e:
                 log_queue.put(("ERROR", f"Render Failed: {traceback.format_exc()}"))
                 return jsonify({"error": str(e)}), 500
@@ -326,12 +352,14 @@ def run_server(config_dict, status_queue, log_queue, data_dir=None, command_data
                             # 直接写入覆盖
                             with zf.open(file_info) as source, open(target_path, "wb") as target:
                                 shutil.copyfileobj(source, target)
+                            if target_dir == plugin_storage.video_dir: schedule_video_proxy(file_name)
 
                 # 更新配置
                 config = plugin_storage.load_config()
                 if 'menus' not in config: config['menus'] = []
                 config['menus'].append(new_menu)
                 plugin_storage.save_config(config)
+                log_queue.put(("CONFIG", "saved"))
 
                 return jsonify({"status": "ok", "menu_name": new_menu['name']})
 